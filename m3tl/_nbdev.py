@@ -7,6 +7,8 @@ index = {"BaseParams": "00_0_base_params.ipynb",
          "StaticBatchParams": "00_0_base_params.ipynb",
          "DynamicBatchSizeParams": "00_0_base_params.ipynb",
          "Params": "00_1_params.ipynb",
+         "verify_fast_tokenizer": "01_utils.ipynb",
+         "get_tokenizer_fingerprint": "01_utils.ipynb",
          "load_transformer_tokenizer": "01_utils.ipynb",
          "load_transformer_config": "01_utils.ipynb",
          "load_transformer_model": "01_utils.ipynb",
@@ -56,6 +58,9 @@ index = {"BaseParams": "00_0_base_params.ipynb",
          "infer_modal": "04_create_bert_features.ipynb",
          "unify_inputs": "04_create_bert_features.ipynb",
          "NextExampleException": "04_create_bert_features.ipynb",
+         "TokenizationCache": "04_create_bert_features.ipynb",
+         "get_tokenization_cache": "04_create_bert_features.ipynb",
+         "batch_text_modal_tokenization": "04_create_bert_features.ipynb",
          "text_modal_input_handling": "04_create_bert_features.ipynb",
          "array_modal_input_handling": "04_create_bert_features.ipynb",
          "category_modal_input_handling": "04_create_bert_features.ipynb",
@@ -67,6 +72,7 @@ index = {"BaseParams": "00_0_base_params.ipynb",
          "convert_legacy_output": "05_preproc_decorator.ipynb",
          "input_format_check": "05_preproc_decorator.ipynb",
          "none_generator": "05_preproc_decorator.ipynb",
+         "stream_in_process_pool": "05_preproc_decorator.ipynb",
          "convert_data_to_features": "05_preproc_decorator.ipynb",
          "convert_data_to_features_pyspark": "05_preproc_decorator.ipynb",
          "check_if_le_created": "05_preproc_decorator.ipynb",
@@ -76,16 +82,29 @@ index = {"BaseParams": "00_0_base_params.ipynb",
          "make_tfrecord_pyspark": "06_read_write_tfrecord.ipynb",
          "make_tfrecord": "06_read_write_tfrecord.ipynb",
          "chain_processed_data": "06_read_write_tfrecord.ipynb",
+         "get_seq_length": "06_read_write_tfrecord.ipynb",
+         "read_length_histogram": "06_read_write_tfrecord.ipynb",
+         "make_tfrecord_cache_manifest": "06_read_write_tfrecord.ipynb",
+         "is_tfrecord_cache_valid": "06_read_write_tfrecord.ipynb",
          "write_tfrecord": "06_read_write_tfrecord.ipynb",
          "make_feature_desc": "06_read_write_tfrecord.ipynb",
          "reshape_tensors_in_dataset": "06_read_write_tfrecord.ipynb",
+         "decode_dense_tensors_in_dataset": "06_read_write_tfrecord.ipynb",
          "add_loss_multiplier": "06_read_write_tfrecord.ipynb",
          "set_shape_for_dataset": "06_read_write_tfrecord.ipynb",
+         "parse_batched_example": "06_read_write_tfrecord.ipynb",
          "get_dummy_features": "06_read_write_tfrecord.ipynb",
          "add_dummy_features_to_dataset": "06_read_write_tfrecord.ipynb",
+         "ragged_to_dense_in_dataset": "06_read_write_tfrecord.ipynb",
+         "add_dummy_features_to_batched_dataset": "06_read_write_tfrecord.ipynb",
          "read_tfrecord": "06_read_write_tfrecord.ipynb",
          "element_length_func": "07_input_fn.ipynb",
          "train_eval_input_fn": "07_input_fn.ipynb",
+         "get_length_histogram": "07_input_fn.ipynb",
+         "get_bucket_batch_sizes": "07_input_fn.ipynb",
+         "get_batch_num": "07_input_fn.ipynb",
+         "get_bucket_config": "07_input_fn.ipynb",
+         "preprocess_predict_inputs": "07_input_fn.ipynb",
          "predict_input_fn": "07_input_fn.ipynb",
          "process_line_msr_pku": "08_predefined_problems_cws.ipynb",
          "process_line_as_training": "08_predefined_problems_cws.ipynb",
@@ -121,6 +140,8 @@ index = {"BaseParams": "00_0_base_params.ipynb",
          "pyspark_fake_cls": "10_predefined_problems_test.ipynb",
          "pyspark_fake_seq_tag": "10_predefined_problems_test.ipynb",
          "pyspark_fake_multi_cls": "10_predefined_problems_test.ipynb",
+         "pack_sequences": "11_modeling.ipynb",
+         "unpack_sequences": "11_modeling.ipynb",
          "MultiModalBertModel": "11_modeling.ipynb",
          "empty_tensor_handling_loss": "12_0_problem_type_utils.ipynb",
          "nan_loss_handling": "12_0_problem_type_utils.ipynb",
@@ -168,14 +189,20 @@ index = {"BaseParams": "00_0_base_params.ipynb",
          "BertMultiTaskTop": "13_model_fn.ipynb",
          "BertMultiTask": "13_model_fn.ipynb",
          "create_keras_model": "14_run_bert_multitask.ipynb",
+         "TrainIteratorCheckpoint": "14_run_bert_multitask.ipynb",
+         "make_checkpointable_dataset": "14_run_bert_multitask.ipynb",
          "get_params_ready": "14_run_bert_multitask.ipynb",
          "train_bert_multitask": "14_run_bert_multitask.ipynb",
          "create_tensorspec_from_shape_type": "14_run_bert_multitask.ipynb",
          "trim_checkpoint_for_prediction": "14_run_bert_multitask.ipynb",
          "eval_bert_multitask": "14_run_bert_multitask.ipynb",
          "arr_to_str": "14_run_bert_multitask.ipynb",
+         "PredictionDecoder": "14_run_bert_multitask.ipynb",
          "decode_predictions": "14_run_bert_multitask.ipynb",
+         "PredictionWriter": "14_run_bert_multitask.ipynb",
          "predict_bert_multitask": "14_run_bert_multitask.ipynb",
+         "predict_bert_multitask_generator": "14_run_bert_multitask.ipynb",
+         "BertMultiTaskPredictor": "14_run_bert_multitask.ipynb",
          "MTLBase": "15-00_mtl_model_base.ipynb",
          "BasicMTL": "15-00_mtl_model_base.ipynb",
          "MMoE": "15-01_mtl_model_mmoe.ipynb",
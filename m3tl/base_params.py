@@ -34,6 +34,9 @@ class BaseParams():
         self.transformer_model_loading = 'TFBertModel'
         self.transformer_config_loading = 'BertConfig'
         self.transformer_tokenizer_loading = 'BertTokenizer'
+        # use fast version of transformer_tokenizer_loading for preprocessing
+        # if it gives the same ids
+        self.use_fast_tokenizer = True
         self.transformer_decoder_model_name = None
         self.transformer_decoder_config_name = None
         self.transformer_decoder_tokenizer_name = None
@@ -116,6 +119,8 @@ class BaseParams():
         self.output_body_seq_hidden = False
         self.output_body_pooled_hidden = False
         self.output_mtl_model_hidden = False
+        # output model_input_mask with predictions to trim decoded sequence predictions
+        self.output_input_mask = False
         # DuplicateAugMultimodalEmbedding parameters
         self.duplicate_data_aug_problems: Union[List[str], str] = None
         # Contrastive Learning parameters
@@ -125,8 +130,44 @@ class BaseParams():
 
         ############### training config #############
         self.num_cpus = 1
+        # max number of examples in flight when preprocessing with num_cpus processes
         self.preprocess_buffer = 100000
+        # number of examples sent to preprocessing process at a time, every chunk
+        # and its features are pickled between processes. tokenizer, label encoder
+        # and params are sent once per worker
+        self.preprocess_chunk_size = 1000
+        # yield preprocessed examples in input order, set to False to yield chunks
+        # as soon as they are done. problems chained with & need order unless
+        # chain_problem_on_record_id is set
+        self.preprocess_ordered = True
         self.example_per_file = 100000
+        # number of processes to serialize and write tfrecord shards
+        self.tfrecord_writer_num_cpus = 1
+        # tfrecord compression, None, 'GZIP' or 'ZLIB'
+        self.tfrecord_compression = None
+        # tfrecord encoding, 'var_len' or 'dense'. dense encoding writes
+        # every feature as raw bytes and avoids sparse ops when reading
+        self.tfrecord_encoding = 'var_len'
+        # storage dtype of integer features for dense encoding. key: feature name
+        # or suffix, value: dtype. e.g. {'_mask': 'uint8', '_segment_ids': 'uint8', '_input_ids': 'uint16'}
+        self.tfrecord_storage_dtype = None
+        # if set, serialized examples are batched and parsed with
+        # vectorized ops when reading tfrecord
+        self.tfrecord_parse_batch_size = None
+        # snapshot decoded tfrecord under tmp_file_dir and read from it after first pass.
+        # in shard shuffle mode, snapshot is split to shards of example_per_file
+        # examples which are shuffled every epoch
+        self.tfrecord_snapshot = False
+        # input files read by preproc fn of every problem, e.g. {'cws': ['data/cws/*.txt']},
+        # size and mtime of these files are part of tfrecord cache fingerprint
+        self.preproc_input_files = {}
+        # join problems chained with & on record_id instead of record order
+        self.chain_problem_on_record_id = False
+        # cache tokenized text inputs in tmp_file_dir, shared by all problems and runs
+        self.tokenization_cache = False
+        # number of examples tokenized in one call of fast tokenizer, also
+        # number of cached results written in one transaction
+        self.tokenization_batch_size = 1000
         self.decode_vocab_file = None
         self.batch_size = 32
         self.train_epoch = 15
@@ -135,7 +176,26 @@ class BaseParams():
         self.dynamic_padding = True
         self.bucket_batch_sizes = [32, 32, 32, 16]
         self.bucket_boundaries = [30, 64, 128]
+        # if set, batch size of every bucket is max_tokens_per_batch // max length of bucket
+        # and bucket_batch_sizes is ignored
+        self.max_tokens_per_batch = None
+        # pack examples of a batch into fewer rows with block-diagonal attention mask
+        self.sequence_packing = False
         self.shuffle_buffer = 200000
+        # 'element' shuffles decoded examples with shuffle_buffer. 'shard' shuffles
+        # train tfrecord files, interleaves shard_shuffle_cycle_length files and
+        # shuffles with shard_shuffle_buffer on top. smaller example_per_file
+        # gives more files and better randomness in shard mode
+        self.shuffle_mode = 'element'
+        self.shard_shuffle_cycle_length = 16
+        self.shard_shuffle_buffer = 1000
+        # save_freq of default ModelCheckpoint, 'epoch' or number of batches
+        self.checkpoint_save_freq = 'epoch'
+        # save train dataset iterator state along with model checkpoint so that
+        # continue_training resumes from where data consumption stopped. the
+        # checkpoint includes the shuffle buffer, use shuffle_mode 'shard' to
+        # keep it small
+        self.checkpoint_train_iterator = False
         self.train_steps = 0
         self.num_warmup_steps = 0
         self.use_horovod = False
@@ -369,7 +429,7 @@ class BaseParams():
 
                 # save tokenizer
                 tokenizer = load_transformer_tokenizer(
-                    self.transformer_tokenizer_name, self.transformer_tokenizer_loading)
+                    self.transformer_tokenizer_name, self.transformer_tokenizer_loading, use_fast=False)
                 tokenizer.save_pretrained(to_tokenizer_path)
                 # save_pretrained method of tokenizer saves the config as tokenizer_config.json, which will cause
                 # OSError if use tokenizer.from_pretrained directly. we need to manually rename the json file
@@ -388,7 +448,7 @@ class BaseParams():
                     self.bert_decoder_config.save_pretrained(
                         to_decoder_config_path)
                     decoder_tokenizer = load_transformer_tokenizer(
-                        self.transformer_decoder_tokenizer_name, self.transformer_decoder_tokenizer_loading)
+                        self.transformer_decoder_tokenizer_name, self.transformer_decoder_tokenizer_loading, use_fast=False)
                     decoder_tokenizer.save_pretrained(
                         to_decoder_tokenizer_path)
                     try:
@@ -413,12 +473,13 @@ class BaseParams():
         self.bert_config_dict = self.bert_config.to_dict()
 
         tokenizer = load_transformer_tokenizer(
-            self.transformer_tokenizer_name, self.transformer_tokenizer_loading)
+            self.transformer_tokenizer_name, self.transformer_tokenizer_loading, use_fast=False)
         self.vocab_size = tokenizer.vocab_size
         if self.transformer_decoder_tokenizer_name:
             decoder_tokenizer = load_transformer_tokenizer(
                 self.transformer_decoder_tokenizer_name,
-                self.transformer_decoder_tokenizer_loading
+                self.transformer_decoder_tokenizer_loading,
+                use_fast=False
             )
 
             # if set bos and eos
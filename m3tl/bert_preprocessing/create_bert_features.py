@@ -1,23 +1,32 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: source_nbs/04_create_bert_features.ipynb (unless otherwise specified).
 
 __all__ = ['convert_labels_to_ids', 'create_bert_pretraining', 'mask_inputs_for_mask_lm', 'collect_modal_name',
-           'infer_modal', 'unify_inputs', 'NextExampleException', 'text_modal_input_handling',
-           'array_modal_input_handling', 'category_modal_input_handling', 'separate_inputs_labels',
-           'remove_dict_prefix', 'create_multimodal_bert_features', 'create_multimodal_bert_features_generator']
+           'infer_modal', 'unify_inputs', 'NextExampleException', 'TokenizationCache', 'get_tokenization_cache',
+           'batch_text_modal_tokenization', 'text_modal_input_handling', 'array_modal_input_handling',
+           'category_modal_input_handling', 'separate_inputs_labels', 'remove_dict_prefix',
+           'create_multimodal_bert_features', 'create_multimodal_bert_features_generator']
 
 # Cell
+import hashlib
+import json
+import os
+import pickle
 import random
+import sqlite3
+from collections import defaultdict
 
 import numpy as np
-from typing import Callable, Dict, Union, Tuple
+from typing import Callable, Dict, List, Union, Tuple
 
+from fastcore.basics import chunked
 from loguru import logger
 
 from ..special_tokens import PREDICT
 from .bert_utils import (create_instances_from_document)
 from ..base_params import BaseParams
+from ..utils import get_tokenizer_fingerprint
 
-from transformers import PreTrainedTokenizer
+from transformers import BatchEncoding, PreTrainedTokenizer
 
 
 
@@ -164,7 +173,8 @@ def mask_inputs_for_mask_lm(inp_text: str, tokenizer: PreTrainedTokenizer, mask_
         padding=False,
         return_special_tokens_mask=False,
         add_special_tokens=True,
-        return_overflowing_tokens=True)
+        # fast tokenizer returns overflowing windows as nested lists
+        return_overflowing_tokens=False)
 
     # create mask lm features
     mask_lm_dict = tokenizer(masked_text,
@@ -254,13 +264,185 @@ class NextExampleException(Exception):
     pass
 
 
+class TokenizationCache:
+    """On-disk cache of tokenized text inputs backed by sqlite
+
+    Key is hash of tokenizer fingerprint, max_seq_len, whether to return
+    special tokens mask and input text. Tokenizer fingerprint does not depend
+    on tokenizer path, so runs with different model dirs share the cache, see
+    `get_tokenizer_fingerprint`. Connection is opened lazily and reopened in
+    forked processes.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = None
+        self._pid = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=60)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS tokenized (key TEXT PRIMARY KEY, value BLOB)')
+            self._pid = os.getpid()
+        return self._conn
+
+    @staticmethod
+    def make_key(tokenizer: PreTrainedTokenizer, max_seq_len: int, return_special_tokens_mask: bool, tokens_a, tokens_b) -> str:
+        key = [get_tokenizer_fingerprint(tokenizer), max_seq_len,
+               return_special_tokens_mask, tokens_a, tokens_b]
+        return hashlib.sha1(json.dumps(key, ensure_ascii=False).encode('utf8')).hexdigest()
+
+    def get(self, key: str) -> Union[BatchEncoding, None]:
+        row = self.conn.execute(
+            'SELECT value FROM tokenized WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        return BatchEncoding(pickle.loads(row[0]))
+
+    def set_many(self, key_list: List[str], tokenized_dict_list: List[dict]):
+        """Write tokenized results in one transaction"""
+        with self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO tokenized VALUES (?, ?)',
+                                  [(key, pickle.dumps(dict(tokenized_dict)))
+                                   for key, tokenized_dict in zip(key_list, tokenized_dict_list)])
+
+    def set(self, key: str, tokenized_dict: dict):
+        self.set_many([key], [tokenized_dict])
+
+
+_TOKENIZATION_CACHE_DICT: Dict[str, TokenizationCache] = {}
+
+
+def get_tokenization_cache(params: BaseParams) -> Union[TokenizationCache, None]:
+    if not params.tokenization_cache:
+        return None
+    path = os.path.join(params.tmp_file_dir, 'tokenization_cache.sqlite')
+    if path not in _TOKENIZATION_CACHE_DICT:
+        _TOKENIZATION_CACHE_DICT[path] = TokenizationCache(path)
+    return _TOKENIZATION_CACHE_DICT[path]
+
+
+def _split_text_modal_inputs(modal_inputs: Union[dict, str, list]) -> tuple:
+    if isinstance(modal_inputs, dict):
+        return modal_inputs['a'], modal_inputs['b']
+    return modal_inputs, None
+
+
+def _get_tokenizer_kwargs(params: BaseParams, is_seq: bool) -> dict:
+    return dict(
+        truncation=True,
+        max_length=params.max_seq_len,
+        padding=False,
+        return_special_tokens_mask=is_seq,
+        add_special_tokens=True,
+        return_overflowing_tokens=True,
+        return_token_type_ids=True)
+
+
+def _fast_tokenizer_encode_plus(text_list: List[tuple], tokenizer: PreTrainedTokenizer, tokenizer_kwargs: dict) -> List[BatchEncoding]:
+    """Same as `encode_plus` of slow tokenizer
+
+    String inputs are tokenized by one batched call of fast tokenizer, list
+    inputs are treated as tokens. Special tokens, truncation and overflow are
+    handled by `prepare_for_model` so that results are not split into
+    overflowing windows like fast tokenizer does.
+    """
+    str_list = [text for text_pair in text_list for text in text_pair if isinstance(text, str)]
+    str_ids_iter = iter(tokenizer(
+        str_list, add_special_tokens=False, verbose=False)['input_ids'] if str_list else [])
+
+    def _get_input_ids(text):
+        if text is None:
+            return None
+        if isinstance(text, str):
+            return next(str_ids_iter)
+        return tokenizer.convert_tokens_to_ids(text)
+
+    # fast tokenizers can only get special tokens mask from ids, which is wrong
+    # for special tokens in text like [UNK]. we get it from the positions of sentinel ids instead
+    return_special_tokens_mask = tokenizer_kwargs['return_special_tokens_mask']
+    tokenizer_kwargs = dict(tokenizer_kwargs, return_special_tokens_mask=False)
+    tokenized_dict_list = []
+    for tokens_a, tokens_b in text_list:
+        ids_a = _get_input_ids(tokens_a)
+        ids_b = _get_input_ids(tokens_b)
+        tokenized_dict = tokenizer.prepare_for_model(
+            ids_a, ids_b, **tokenizer_kwargs)
+        if return_special_tokens_mask:
+            sentinel_ids = tokenizer.prepare_for_model(
+                [-1 for _ in ids_a], None if ids_b is None else [-1 for _ in ids_b],
+                **tokenizer_kwargs)['input_ids']
+            tokenized_dict['special_tokens_mask'] = [
+                0 if i == -1 else 1 for i in sentinel_ids]
+        tokenized_dict_list.append(tokenized_dict)
+    return tokenized_dict_list
+
+
+def batch_text_modal_tokenization(
+        modal_inputs_list: list,
+        is_seq: bool,
+        params: BaseParams,
+        tokenizer: PreTrainedTokenizer) -> List[BatchEncoding]:
+    """Tokenize text modal inputs of multiple examples
+
+    Results are the same as calling `encode_plus` of slow tokenizer on every
+    example. Fast tokenizers tokenize all string inputs with one call.
+    """
+    tokenization_cache = get_tokenization_cache(params)
+    tokenized_dict_list = [None for _ in modal_inputs_list]
+    cache_key_list = [None for _ in modal_inputs_list]
+    text_list = []
+    for idx, modal_inputs in enumerate(modal_inputs_list):
+        tokens_a, tokens_b = _split_text_modal_inputs(modal_inputs)
+        if tokenization_cache is not None:
+            cache_key_list[idx] = TokenizationCache.make_key(
+                tokenizer, params.max_seq_len, is_seq, tokens_a, tokens_b)
+            tokenized_dict_list[idx] = tokenization_cache.get(
+                cache_key_list[idx])
+            if tokenized_dict_list[idx] is not None:
+                continue
+        text_list.append((tokens_a, tokens_b))
+
+    if not text_list:
+        return tokenized_dict_list
+
+    tokenizer_kwargs = _get_tokenizer_kwargs(params, is_seq)
+    if getattr(tokenizer, 'is_fast', False):
+        new_tokenized_dict_list = _fast_tokenizer_encode_plus(
+            text_list, tokenizer, tokenizer_kwargs)
+    else:
+        new_tokenized_dict_list = [tokenizer.encode_plus(
+            tokens_a, tokens_b, is_split_into_words=False, **tokenizer_kwargs)
+            for tokens_a, tokens_b in text_list]
+
+    missing_idx_list = [idx for idx, tokenized_dict in enumerate(
+        tokenized_dict_list) if tokenized_dict is None]
+    for idx, tokenized_dict in zip(missing_idx_list, new_tokenized_dict_list):
+        tokenized_dict_list[idx] = tokenized_dict
+    if tokenization_cache is not None:
+        tokenization_cache.set_many(
+            [cache_key_list[idx] for idx in missing_idx_list], new_tokenized_dict_list)
+    return tokenized_dict_list
+
+
 def text_modal_input_handling(
         problem: str,
         modal_name: str,
         modal_inputs: dict,
         target: dict = None,
         params: BaseParams = None,
-        tokenizer: PreTrainedTokenizer = None) -> Tuple[dict, dict]:
+        tokenizer: PreTrainedTokenizer = None,
+        tokenized_dict: dict = None) -> Tuple[dict, dict]:
+    """Create features of text modal
+
+    If `tokenized_dict` is provided, e.g. by `batch_text_modal_tokenization`,
+    inputs will not be tokenized again.
+    """
     is_mask_lm = (
         params.problem_type[problem] == 'masklm'
         if problem in params.problem_type else False
@@ -270,12 +452,7 @@ def text_modal_input_handling(
         if problem in params.problem_type else False
     )
     # tokenize inputs, now the length is fixed, target == raw_target
-    if isinstance(modal_inputs, dict):
-        tokens_a = modal_inputs['a']
-        tokens_b = modal_inputs['b']
-    else:
-        tokens_a = modal_inputs
-        tokens_b = None
+    tokens_a, tokens_b = _split_text_modal_inputs(modal_inputs)
 
     if is_mask_lm:
         tokenized_dict, mlm_feature_dict = mask_inputs_for_mask_lm(
@@ -287,16 +464,10 @@ def text_modal_input_handling(
     else:
         mlm_feature_dict = {}
 
-        tokenized_dict = tokenizer.encode_plus(
-            tokens_a, tokens_b,
-            truncation=True,
-            max_length=params.max_seq_len,
-            is_split_into_words=False,
-            padding=False,
-            return_special_tokens_mask=is_seq,
-            add_special_tokens=True,
-            return_overflowing_tokens=True,
-            return_token_type_ids=True)
+        # masked inputs are random, only plain tokenization is cached
+        if tokenized_dict is None:
+            tokenized_dict = batch_text_modal_tokenization(
+                [modal_inputs], is_seq=is_seq, params=params, tokenizer=tokenizer)[0]
 
     input_ids = tokenized_dict['input_ids']
     segment_ids = tokenized_dict['token_type_ids']
@@ -406,6 +577,42 @@ def remove_dict_prefix(inp: dict, key='inputs_') -> dict:
 
 # Cell
 
+def _tokenize_examples_in_batch(example_list, params, tokenizer, problem_type, is_seq):
+    """Separate inputs and labels of examples. If tokenizer is fast or
+    tokenization cache is enabled, text modal inputs are tokenized in batches
+    of `params.tokenization_batch_size` and cached results are written once
+    per batch.
+
+    Yields:
+        tuple: raw_inputs, raw_target, tokenized dict of every text modal
+    """
+    batch_size = params.tokenization_batch_size or 1
+    use_batch = (getattr(tokenizer, 'is_fast', False) or params.tokenization_cache) and \
+        problem_type != 'masklm' and batch_size > 1
+    for example_chunk in chunked(example_list, chunk_sz=batch_size):
+        parsed_list = []
+        for example in example_chunk:
+            raw_inputs, raw_target = separate_inputs_labels(example)
+            parsed_list.append((unify_inputs(raw_inputs), raw_target))
+
+        tokenized_list = [{} for _ in parsed_list]
+        if use_batch:
+            text_modal_idx = defaultdict(list)
+            for idx, (raw_inputs, _) in enumerate(parsed_list):
+                for modal_name in collect_modal_name(raw_inputs):
+                    if raw_inputs['{}_modal_type'.format(modal_name)] == 'text':
+                        text_modal_idx[modal_name].append(idx)
+            for modal_name, idx_list in text_modal_idx.items():
+                tokenized_dict_list = batch_text_modal_tokenization(
+                    [parsed_list[idx][0][modal_name] for idx in idx_list],
+                    is_seq=is_seq, params=params, tokenizer=tokenizer)
+                for idx, tokenized_dict in zip(idx_list, tokenized_dict_list):
+                    tokenized_list[idx][modal_name] = tokenized_dict
+
+        for (raw_inputs, raw_target), tokenized in zip(parsed_list, tokenized_list):
+            yield raw_inputs, raw_target, tokenized
+
+
 def _create_multimodal_bert_features(problem,
                                      example_list,
                                      label_encoder,
@@ -425,10 +632,9 @@ def _create_multimodal_bert_features(problem,
 
     is_mask_lm = problem_type == 'masklm'
 
-    for example_id, example in enumerate(example_list):
-        raw_inputs, raw_target = separate_inputs_labels(example)
-
-        raw_inputs = unify_inputs(raw_inputs)
+    example_iter = _tokenize_examples_in_batch(
+        example_list, params, tokenizer, problem_type, is_seq)
+    for example_id, (raw_inputs, raw_target, tokenized_inputs) in enumerate(example_iter):
         modal_name_list = [m for m in collect_modal_name(
             raw_inputs) if m != 'record_id']
 
@@ -459,7 +665,8 @@ def _create_multimodal_bert_features(problem,
                         modal_inputs=modal_inputs,
                         target=target,
                         params=params,
-                        tokenizer=tokenizer
+                        tokenizer=tokenizer,
+                        tokenized_dict=tokenized_inputs.get(modal_name)
                     )
 
                 elif modal_type == 'array':
@@ -1,12 +1,19 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: source_nbs/07_input_fn.ipynb (unless otherwise specified).
 
-__all__ = ['element_length_func', 'train_eval_input_fn', 'predict_input_fn']
+__all__ = ['element_length_func', 'train_eval_input_fn', 'get_length_histogram', 'get_bucket_batch_sizes',
+           'get_batch_num', 'get_bucket_config', 'preprocess_predict_inputs', 'predict_input_fn']
 
 # Cell
-from typing import List, Union, Dict
+from typing import Iterable, List, Union, Dict, Optional, Tuple
 import json
+import math
+import os
+from bisect import bisect_right
+from collections import Counter
+from itertools import chain, islice
 from loguru import logger
 
+import numpy as np
 import tensorflow as tf
 
 from .params import Params
@@ -68,14 +75,18 @@ def train_eval_input_fn(params: Params, mode=TRAIN) -> tf.data.Dataset:
     dataset = dataset.with_options(options)
 
     if mode == TRAIN:
-        dataset = dataset.shuffle(params.shuffle_buffer)
+        # files are already shuffled in shard mode, a small buffer is enough
+        if params.shuffle_mode == 'shard':
+            dataset = dataset.shuffle(params.shard_shuffle_buffer)
+        else:
+            dataset = dataset.shuffle(params.shuffle_buffer)
 
     dataset = dataset.prefetch(tf.data.experimental.AUTOTUNE)
     if params.dynamic_padding:
         dataset = dataset.apply(
             tf.data.experimental.bucket_by_sequence_length(
                 element_length_func=element_length_func,
-                bucket_batch_sizes=params.bucket_batch_sizes,
+                bucket_batch_sizes=get_bucket_batch_sizes(params, mode=mode),
                 bucket_boundaries=params.bucket_boundaries
             ))
     else:
@@ -90,14 +101,186 @@ def train_eval_input_fn(params: Params, mode=TRAIN) -> tf.data.Dataset:
     return dataset
 
 
+def get_length_histogram(params: Params, mode=TRAIN) -> Optional[Counter]:
+    """Get histogram of `element_length_func` of all problem chunks.
+
+    Histograms are recorded by `write_tfrecord`. Returns None if histogram
+    is not available, e.g. tfrecord is created with pyspark.
+    """
+    chunk_histogram_dict = {}
+    chunk_input_ids_dict = {}
+    for problem_chunk in params.get_problem_chunk(as_str=True):
+        feature_desc_path = os.path.join(
+            params.tmp_file_dir, problem_chunk, '{}_feature_desc.json'.format(mode))
+        try:
+            chunk_histogram_dict[problem_chunk] = params.get_problem_info(
+                problem=problem_chunk, info_name='{}_length_histogram'.format(mode))
+            with open(feature_desc_path, 'r', encoding='utf8') as f:
+                feature_desc_dict = json.load(f)
+        except (KeyError, FileNotFoundError):
+            return None
+        chunk_input_ids_dict[problem_chunk] = {
+            k: feature_desc_dict['{}_shape_value'.format(k)]
+            for k in feature_desc_dict if 'input_ids' in k and '_shape' not in k}
+
+    # input ids of other chunks are added as dummy features with length 1
+    all_input_ids = {}
+    for input_ids_shape in chunk_input_ids_dict.values():
+        all_input_ids.update(input_ids_shape)
+    length_histogram = Counter()
+    for problem_chunk, histogram in chunk_histogram_dict.items():
+        dummy_length = sum([1 if shape[0] is None else shape[0]
+                            for k, shape in all_input_ids.items() if k not in chunk_input_ids_dict[problem_chunk]])
+        for length, count in histogram:
+            length_histogram[length+dummy_length] += count
+    return length_histogram
+
+
+def get_bucket_batch_sizes(params: Params, mode=TRAIN) -> List[int]:
+    """Get batch size of every bucket for dynamic padding.
+
+    If `params.max_tokens_per_batch` is set, batch size of every bucket
+    is the max number of rows that keeps padded tokens of a batch within
+    the budget, otherwise `params.bucket_batch_sizes` is returned.
+    """
+    if not params.max_tokens_per_batch:
+        return params.bucket_batch_sizes
+
+    # max length of last bucket is unknown, use the longest record if possible
+    length_histogram = get_length_histogram(params, mode=mode)
+    if length_histogram:
+        last_bucket_max_length = max(length_histogram.keys())
+    else:
+        last_bucket_max_length = params.max_seq_len
+    bucket_max_length = [boundary - 1 for boundary in params.bucket_boundaries]
+    bucket_max_length.append(
+        max([last_bucket_max_length] + params.bucket_boundaries))
+    return [max(1, params.max_tokens_per_batch // max(length, 1)) for length in bucket_max_length]
+
+
+def get_batch_num(params: Params, mode=TRAIN) -> Optional[int]:
+    """Get number of batches of `train_eval_input_fn` without iterating dataset.
+
+    Number of batches is calculated from length histogram recorded by
+    `write_tfrecord` and bucketing params. Returns None if histogram
+    is not available, e.g. tfrecord is created with pyspark.
+    """
+    if params.use_horovod or get_is_pyspark():
+        return None
+
+    length_histogram = get_length_histogram(params, mode=mode)
+    if length_histogram is None:
+        return None
+
+    if not params.dynamic_padding:
+        batch_size = params.batch_size if mode == TRAIN else params.batch_size*2
+        return math.ceil(sum(length_histogram.values()) / batch_size)
+
+    # bucket i contains lengths in [bucket_boundaries[i-1], bucket_boundaries[i])
+    bucket_batch_sizes = get_bucket_batch_sizes(params, mode=mode)
+    bucket_count = Counter()
+    for length, count in length_histogram.items():
+        bucket_count[bisect_right(params.bucket_boundaries, length)] += count
+    return sum([math.ceil(count / bucket_batch_sizes[bucket_id]) for bucket_id, count in bucket_count.items()])
+
+
+def get_bucket_config(params: Params, num_buckets=4, token_budget: int = None, mode=TRAIN) -> Tuple[List[int], List[int]]:
+    """Derive `bucket_boundaries` and `bucket_batch_sizes` from length histogram.
+
+    Boundaries are chosen to minimize number of padded tokens, assuming every
+    sequence is padded to the longest length of its bucket. Batch size of every
+    bucket is `token_budget` // longest length of the bucket, so every batch
+    has roughly the same number of tokens.
+
+    Example:
+        params.bucket_boundaries, params.bucket_batch_sizes = get_bucket_config(params)
+
+    Args:
+        params (Params): params
+        num_buckets (int, optional): max number of buckets. Defaults to 4.
+        token_budget (int, optional): max number of tokens per batch. Defaults to
+            params.batch_size * params.max_seq_len.
+
+    Returns:
+        Tuple[List[int], List[int]]: bucket_boundaries, bucket_batch_sizes
+    """
+    length_histogram = get_length_histogram(params, mode=mode)
+    if not length_histogram:
+        raise ValueError(
+            'length histogram not found, please create tfrecord with write_tfrecord first.')
+    if token_budget is None:
+        token_budget = params.batch_size * params.max_seq_len
+
+    length_list = sorted(length_histogram.keys())
+    count_cumsum = [0]
+    for length in length_list:
+        count_cumsum.append(count_cumsum[-1] + length_histogram[length])
+    num_buckets = min(num_buckets, len(length_list))
+
+    # padded_tokens[k][j]: min padded tokens of length_list[:j] with k buckets
+    # last_start[k][j]: start index of the last bucket of the solution
+    inf = float('inf')
+    padded_tokens = [[inf] * (len(length_list) + 1)
+                     for _ in range(num_buckets + 1)]
+    last_start = [[0] * (len(length_list) + 1)
+                  for _ in range(num_buckets + 1)]
+    padded_tokens[0][0] = 0
+    for k in range(1, num_buckets + 1):
+        for j in range(k, len(length_list) + 1):
+            for i in range(k - 1, j):
+                tokens = padded_tokens[k - 1][i] + \
+                    (count_cumsum[j] - count_cumsum[i]) * length_list[j - 1]
+                if tokens < padded_tokens[k][j]:
+                    padded_tokens[k][j] = tokens
+                    last_start[k][j] = i
+
+    # backtrack longest length of every bucket
+    bucket_max_length = []
+    j = len(length_list)
+    for k in range(num_buckets, 0, -1):
+        bucket_max_length.append(length_list[j - 1])
+        j = last_start[k][j]
+    bucket_max_length = bucket_max_length[::-1]
+
+    bucket_boundaries = [length + 1 for length in bucket_max_length[:-1]]
+    bucket_batch_sizes = [max(1, token_budget // max(length, 1))
+                          for length in bucket_max_length]
+    return bucket_boundaries, bucket_batch_sizes
+
 # Cell
+def preprocess_predict_inputs(inputs: Iterable, params: Params, mode=PREDICT) -> Iterable[dict]:
+    '''Create features of prediction inputs without label
+
+    Arguments:
+        inputs {Iterable} -- inputs, e.g. list of text or dict of modalities
+        params {Params} -- Params object
+
+    Keyword Arguments:
+        mode {str} -- ModeKeys (default: {PREDICT})
+
+    Returns:
+        Iterable[dict] -- iterable of feature dict
+    '''
+    # ugly wrapping
+    @preprocessing_fn
+    def gen_wrapper(params, mode):
+        return inputs
+    return gen_wrapper(params, mode)
+
+
 def predict_input_fn(input_file_or_list: Union[str, List[str]],
                      params: Params,
                      mode=PREDICT,
-                     labels_in_input=False) -> tf.data.Dataset:
+                     labels_in_input=False,
+                     return_first_batch=False) -> Union[tf.data.Dataset, Tuple[tf.data.Dataset, Dict[str, np.ndarray]]]:
     '''Input function that takes a file path or list of string and
     convert it to tf.dataset
 
+    Inputs are preprocessed only once: the first batch is cached to infer
+    shapes and then replayed before the rest of inputs. So one-shot iterators,
+    e.g. generators or file objects, are supported as well, but the dataset
+    can only be iterated through once in this case.
+
     Example:
         predict_fn = lambda: predict_input_fn('test.txt', params)
         pred = estimator.predict(predict_fn)
@@ -108,9 +291,11 @@ def predict_input_fn(input_file_or_list: Union[str, List[str]],
 
     Keyword Arguments:
         mode {str} -- ModeKeys (default: {PREDICT})
+        return_first_batch {bool} -- whether to return the padded first batch
+            as numpy dict as well, e.g. to build model (default: {False})
 
     Returns:
-        tf dataset -- tf dataset
+        tf dataset -- tf dataset, or tuple of (tf dataset, first batch)
     '''
 
     # if is string, treat it as path to file
@@ -119,18 +304,28 @@ def predict_input_fn(input_file_or_list: Union[str, List[str]],
     else:
         inputs = input_file_or_list
 
-    # ugly wrapping
     def gen():
-        @preprocessing_fn
-        def gen_wrapper(params, mode):
-            return inputs
-        return gen_wrapper(params, mode)
+        return preprocess_predict_inputs(inputs, params, mode)
+
+    feature_iter = gen()
+    first_batch_dict_list = list(islice(feature_iter, params.batch_size))
+    if not first_batch_dict_list:
+        raise ValueError('no input to predict')
 
-    first_dict = next(gen())
+    output_shapes, output_type = infer_shape_and_type_from_dict(
+        first_batch_dict_list[0])
+
+    # the first call replays cached first batch and continues the same
+    # iterator, later calls(if any) re-create preprocessing generator
+    started_iter_list = [chain(first_batch_dict_list, feature_iter)]
+
+    def dataset_gen():
+        if started_iter_list:
+            return started_iter_list.pop()
+        return gen()
 
-    output_shapes, output_type = infer_shape_and_type_from_dict(first_dict)
     dataset = tf.data.Dataset.from_generator(
-        gen, output_types=output_type, output_shapes=output_shapes)
+        dataset_gen, output_types=output_type, output_shapes=output_shapes)
 
     dataset = dataset.padded_batch(
         params.batch_size,
@@ -138,4 +333,10 @@ def predict_input_fn(input_file_or_list: Union[str, List[str]],
     )
     # dataset = dataset.batch(config.batch_size*2)
 
-    return dataset
+    if not return_first_batch:
+        return dataset
+
+    first_batch = next(tf.data.Dataset.from_generator(
+        lambda: iter(first_batch_dict_list), output_types=output_type, output_shapes=output_shapes
+    ).padded_batch(params.batch_size, output_shapes).as_numpy_iterator())
+    return dataset, first_batch
@@ -247,6 +247,9 @@ class BertMultiTask(tf.keras.Model):
         if self.params.output_body_pooled_hidden:
             pred_dict['pooled'] = body_outputs[1]['all']['pooled']
 
+        if self.params.output_input_mask:
+            pred_dict['model_input_mask'] = body_outputs[0]['all']['model_input_mask']
+
         if self.mtl_model_include_top:
             problem_pred = self.mtl_model(
                 body_outputs)
@@ -380,4 +383,6 @@ class BertMultiTask(tf.keras.Model):
 
     def predict_step(self, data):
         set_phase(PREDICT)
-        return self(data)
\ No newline at end of file
+        # predict_on_batch wraps features as (features,)
+        features, _, _ = tf.keras.utils.unpack_x_y_sample_weight(data)
+        return self(features)
\ No newline at end of file
@@ -1,21 +1,89 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: source_nbs/11_modeling.ipynb (unless otherwise specified).
 
-__all__ = ['MultiModalBertModel']
+__all__ = ['pack_sequences', 'unpack_sequences', 'MultiModalBertModel']
 
 # Cell
 # nbdev_comment from __future__ import absolute_import, division, print_function
 
 import json
+from functools import partial
+from inspect import signature
+from typing import Dict
 
 import tensorflow as tf
 import transformers
 from loguru import logger
 from .params import Params
 from .utils import (get_embedding_table_from_model,
-                        get_shape_list, load_transformer_model)
+                        get_shape_list, get_transformer_main_model, load_transformer_model)
 from .embedding_layer.base import DefaultMultimodalEmbedding
 
 
+def pack_sequences(embedding: tf.Tensor, input_mask: tf.Tensor, token_type_ids: tf.Tensor) -> Dict[str, tf.Tensor]:
+    """Pack valid tokens of a batch into fewer rows.
+
+    Examples are put into rows in order (next-fit), every row is as long
+    as the input rows. Position ids keep the position of every token in its
+    original row, so with the returned block-diagonal attention mask, outputs
+    of valid tokens are the same as unpacked inputs.
+
+    Args:
+        embedding (tf.Tensor): [batch_size, seq_length, hidden_size]
+        input_mask (tf.Tensor): [batch_size, seq_length]
+        token_type_ids (tf.Tensor): [batch_size, seq_length]
+
+    Returns:
+        Dict[str, tf.Tensor]: packed embedding, token_type_ids, position_ids, attention_mask
+            and indices of valid tokens to unpack with `unpack_sequences`.
+    """
+    input_mask = tf.cast(input_mask, tf.int32)
+    seq_length = tf.shape(input_mask)[1]
+    example_length = tf.reduce_sum(input_mask, axis=1)
+
+    def _next_fit(state, length):
+        row_id, row_end = state
+        use_new_row = row_end + length > seq_length
+        return (tf.where(use_new_row, row_id + 1, row_id),
+                tf.where(use_new_row, length, row_end + length))
+    row_ids, row_end = tf.scan(
+        _next_fit, example_length, initializer=(tf.constant(0), tf.constant(0)))
+    row_start = row_end - example_length
+    num_rows = tf.reduce_max(tf.concat([[-1], row_ids], axis=0)) + 1
+
+    # [num_valid_tokens, 2]
+    unpacked_idx = tf.where(input_mask > 0)
+    example_ids = tf.cast(unpacked_idx[:, 0], tf.int32)
+    token_rank = tf.gather_nd(tf.cumsum(input_mask, axis=1) - 1, unpacked_idx)
+    packed_idx = tf.stack([tf.gather(row_ids, example_ids),
+                           tf.gather(row_start, example_ids) + token_rank], axis=1)
+
+    packed_shape = tf.stack([num_rows, seq_length])
+    packed_example_ids = tf.scatter_nd(
+        packed_idx, example_ids + 1, packed_shape)
+    # token can only attend to tokens of the same example
+    attention_mask = tf.logical_and(
+        tf.equal(packed_example_ids[:, :, None],
+                 packed_example_ids[:, None, :]),
+        packed_example_ids[:, None, :] > 0)
+
+    return {
+        'embedding': tf.scatter_nd(packed_idx, tf.gather_nd(embedding, unpacked_idx),
+                                   tf.concat([packed_shape, tf.shape(embedding)[2:]], axis=0)),
+        'token_type_ids': tf.scatter_nd(packed_idx, tf.gather_nd(token_type_ids, unpacked_idx), packed_shape),
+        'position_ids': tf.scatter_nd(packed_idx, tf.cast(unpacked_idx[:, 1], tf.int32), packed_shape),
+        'attention_mask': attention_mask,
+        'packed_idx': packed_idx,
+        'unpacked_idx': unpacked_idx
+    }
+
+
+def unpack_sequences(packed: tf.Tensor, packed_idx: tf.Tensor, unpacked_idx: tf.Tensor, batch_shape: tf.Tensor) -> tf.Tensor:
+    """Scatter packed tensor back to [batch_size, seq_length, ...], padding positions are zeros"""
+    return tf.scatter_nd(
+        unpacked_idx, tf.gather_nd(packed, packed_idx),
+        tf.concat([tf.cast(batch_shape, tf.int64), tf.shape(packed, out_type=tf.int64)[2:]], axis=0))
+
+
 class MultiModalBertModel(tf.keras.Model):
     def __init__(self, params: Params, use_one_hot_embeddings=False):
         super(MultiModalBertModel, self).__init__()
@@ -35,6 +103,65 @@ class MultiModalBertModel(tf.keras.Model):
         self.multimoda_embedding = self.params.embedding_layer['model'](
             params=self.params, embedding_layer=self.embedding_layer)
 
+        if self.params.sequence_packing:
+            self.transformer_main_layer = get_transformer_main_model(
+                self.bert_model)
+            if not hasattr(self.transformer_main_layer, 'encoder'):
+                raise ValueError('sequence packing is not supported by {}'.format(
+                    self.params.transformer_model_loading))
+            # some models, e.g. roberta, count position from padding_idx+1
+            padding_idx = getattr(
+                self.transformer_main_layer.embeddings, 'padding_idx', None)
+            self.position_id_offset = 0 if padding_idx is None else padding_idx + 1
+
+    def call_packed_transformer(self, training=False):
+        """Run transformer on packed embedding with block-diagonal attention mask"""
+        main_layer = self.transformer_main_layer
+        packed = pack_sequences(
+            self.embedding_output, self.model_input_mask, self.model_token_type_ids)
+        embedding_output = main_layer.embeddings(
+            input_ids=None,
+            position_ids=packed['position_ids'] + self.position_id_offset,
+            token_type_ids=packed['token_type_ids'],
+            inputs_embeds=packed['embedding'],
+            training=training)
+        attention_mask = tf.cast(
+            packed['attention_mask'][:, tf.newaxis, :, :], embedding_output.dtype)
+        attention_mask = (1.0 - attention_mask) * -10000.0
+
+        # signature of encoder differs across models
+        encoder_kwargs = {
+            'hidden_states': embedding_output,
+            'attention_mask': attention_mask,
+            'head_mask': [None] * self.bert_model.config.num_hidden_layers,
+            'encoder_hidden_states': None,
+            'encoder_attention_mask': None,
+            'past_key_values': None,
+            'use_cache': False,
+            'output_attentions': False,
+            'output_hidden_states': True,
+            'return_dict': True,
+            'training': training
+        }
+        encoder_signature = signature(main_layer.encoder.call).parameters
+        encoder_outputs = main_layer.encoder(
+            **{k: v for k, v in encoder_kwargs.items() if k in encoder_signature})
+
+        unpack = partial(unpack_sequences, packed_idx=packed['packed_idx'],
+                         unpacked_idx=packed['unpacked_idx'], batch_shape=tf.shape(self.model_input_mask))
+        sequence_output = unpack(encoder_outputs.last_hidden_state)
+        outputs = {
+            'last_hidden_state': sequence_output,
+            'hidden_states': tuple([unpack(h) for h in encoder_outputs.hidden_states])
+        }
+        if getattr(main_layer, 'pooler', None) is not None:
+            # bert pooler takes sequence while albert pooler takes first token
+            pooled_output = main_layer.pooler(sequence_output[:, :1])
+            if len(pooled_output.shape) == 3:
+                pooled_output = pooled_output[:, 0]
+            outputs['pooler_output'] = pooled_output
+        return transformers.modeling_tf_outputs.TFBaseModelOutputWithPooling(**outputs)
+
     @tf.function
     def call(self, inputs, training=False):
         emb_inputs, embedding_tup = self.multimoda_embedding(inputs, training)
@@ -42,14 +169,17 @@ class MultiModalBertModel(tf.keras.Model):
         self.model_input_mask = embedding_tup.res_input_mask
         self.model_token_type_ids = embedding_tup.res_segment_ids
 
-        outputs = self.bert_model(
-            {'input_ids': None,
-             'inputs_embeds': self.embedding_output,
-             'attention_mask': self.model_input_mask,
-             'token_type_ids': self.model_token_type_ids,
-             'position_ids': None},
-            training=training
-        )
+        if self.params.sequence_packing:
+            outputs = self.call_packed_transformer(training=training)
+        else:
+            outputs = self.bert_model(
+                {'input_ids': None,
+                 'inputs_embeds': self.embedding_output,
+                 'attention_mask': self.model_input_mask,
+                 'token_type_ids': self.model_token_type_ids,
+                 'position_ids': None},
+                training=training
+            )
         self.sequence_output = outputs.last_hidden_state
         if 'pooler_output' in outputs:
             self.pooled_output = outputs.pooler_output
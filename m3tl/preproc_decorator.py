@@ -1,15 +1,22 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: source_nbs/05_preproc_decorator.ipynb (unless otherwise specified).
 
 __all__ = ['has_key_startswith', 'convert_legacy_output', 'input_format_check', 'none_generator',
-           'convert_data_to_features', 'convert_data_to_features_pyspark', 'check_if_le_created', 'preprocessing_fn']
+           'stream_in_process_pool', 'convert_data_to_features', 'convert_data_to_features_pyspark',
+           'check_if_le_created', 'preprocessing_fn']
 
 # Cell
+import pickle
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+from functools import wraps
+from itertools import chain
 from typing import Any, Callable, Iterable, Generator
 
 from loguru import logger
-from fastcore.basics import chunked, listify, partial
+from fastcore.basics import chunked
 from fastcore.parallel import num_cpus
-from joblib import Parallel, delayed
+from joblib.externals.loky.backend.reduction import dumps as loky_dumps
+from joblib.externals.loky import ProcessPoolExecutor
 import pandas as pd
 
 from .bert_preprocessing.create_bert_features import \
@@ -45,6 +52,9 @@ def convert_legacy_output(inp: Generator[tuple, None, None]) -> dict:
         if isinstance(record, dict):
             yield record
         else:
+            # text without label, e.g. lines of prediction input file
+            if isinstance(record, str):
+                record = (record, None)
             inputs, labels = record
 
             # need to do conversion
@@ -95,6 +105,68 @@ def none_generator(length: int = None) -> Generator[None, None, None]:
             yield None
 
 
+# part_fn_kwargs of worker process, set once by _init_worker
+_PREPROCESS_WORKER_KWARGS = {}
+
+
+def _init_worker(kwargs_bytes: bytes):
+    _PREPROCESS_WORKER_KWARGS.clear()
+    _PREPROCESS_WORKER_KWARGS.update(pickle.loads(kwargs_bytes))
+
+
+def _preprocess_worker_fn(example_list: list) -> list:
+    return create_multimodal_bert_features(
+        example_list=example_list, **_PREPROCESS_WORKER_KWARGS)
+
+
+def _get_done_results(pending: deque, ordered: bool) -> Iterable[list]:
+    """Wait and yield results of at least one pending future"""
+    if ordered:
+        yield pending.popleft().result()
+        return
+    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+    for future in done:
+        pending.remove(future)
+        yield future.result()
+
+
+def stream_in_process_pool(data_iter: Iterable, part_fn_kwargs: dict, num_workers: int,
+                           chunk_size: int, max_pending: int, ordered=True) -> Iterable[list]:
+    """Create features in a process pool, streaming chunks of examples
+
+    Workers are spawned by a loky executor, the joblib backend, instead of
+    forking a process that has already loaded tensorflow and tokenizers.
+    `part_fn_kwargs`, e.g. tokenizer, label encoder and params, are pickled
+    with the loky pickler(cloudpickle) once and every worker is initialized
+    with them once. Then only chunks of `chunk_size` examples are sent to
+    workers and their features pickled back, so `chunk_size` trades pickling
+    overhead per chunk against memory and latency. At most `max_pending`
+    chunks are in flight. Results of chunks are yielded in input order if
+    `ordered`, otherwise as soon as they complete.
+
+    Every stream has its own executor since streams of chained problems are
+    consumed at the same time with different kwargs. Workers are shut down
+    when the stream ends.
+    """
+    executor = ProcessPoolExecutor(
+        max_workers=num_workers, initializer=_init_worker,
+        initargs=(loky_dumps(part_fn_kwargs),))
+    pending = deque()
+    try:
+        for example_list in chunked(data_iter, chunk_sz=chunk_size):
+            pending.append(executor.submit(
+                _preprocess_worker_fn, example_list))
+            if len(pending) >= max_pending:
+                yield from _get_done_results(pending, ordered)
+        while pending:
+            yield from _get_done_results(pending, ordered)
+    finally:
+        # stop pending chunks if stream is closed early
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
 def convert_data_to_features(problem: str, data_iter: Iterable, params: Params, label_encoder: Any, tokenizer: Any, mode=TRAIN) -> Iterable[dict]:
 
     if mode != PREDICT:
@@ -108,26 +180,30 @@ def convert_data_to_features(problem: str, data_iter: Iterable, params: Params,
         problem_type = 'cls'
         is_seq = False
 
-    part_fn = partial(create_multimodal_bert_features, problem=problem,
-                      label_encoder=label_encoder,
-                      params=params,
-                      tokenizer=tokenizer,
-                      mode=mode,
-                      problem_type=problem_type,
-                      is_seq=is_seq)
-    preprocess_buffer = params.preprocess_buffer
-    data_buffer_list = []
+    part_fn_kwargs = dict(problem=problem,
+                          label_encoder=label_encoder,
+                          params=params,
+                          tokenizer=tokenizer,
+                          mode=mode,
+                          problem_type=problem_type,
+                          is_seq=is_seq)
     num_cpus = params.num_cpus if params.num_cpus > 0 else num_cpus()
     # no easy fix for prediction in multiprocessing
     # phase is not shared between processes
     num_cpus = 1 if mode == PREDICT else num_cpus
-    for data_buffer_list in chunked(data_iter, chunk_sz=preprocess_buffer):
-        per_cpu_chunk = listify(chunked(data_buffer_list, n_chunks=num_cpus))
-        res_gen = Parallel(num_cpus)(delayed(part_fn)(example_list=d_list)
-                                     for d_list in per_cpu_chunk)
-        for d_list in res_gen:
-            for d in d_list:
-                yield d
+    chunk_size = params.preprocess_chunk_size
+    if num_cpus == 1:
+        res_gen = (create_multimodal_bert_features(example_list=d_list, **part_fn_kwargs)
+                   for d_list in chunked(data_iter, chunk_sz=chunk_size))
+    else:
+        # preprocess_buffer bounds number of examples in flight
+        res_gen = stream_in_process_pool(
+            data_iter, part_fn_kwargs, num_workers=num_cpus, chunk_size=chunk_size,
+            max_pending=max(params.preprocess_buffer // chunk_size, num_cpus),
+            ordered=params.preprocess_ordered)
+    for d_list in res_gen:
+        for d in d_list:
+            yield d
 
 
 def convert_data_to_features_pyspark(
@@ -191,11 +267,13 @@ def preprocessing_fn(func: Callable):
     Args:
         func (Callable): preprocessing function for problem
     """
+    @wraps(func)
     def wrapper(params, mode, get_data_num=False, write_tfrecord=True):
         problem = func.__name__
 
         tokenizer = load_transformer_tokenizer(
-            params.transformer_tokenizer_name, params.transformer_tokenizer_loading)
+            params.transformer_tokenizer_name, params.transformer_tokenizer_loading,
+            use_fast=params.use_fast_tokenizer)
 
         # proc func can return one of the following types:
         # - Generator
@@ -238,13 +316,16 @@ def preprocessing_fn(func: Callable):
         elif isinstance(example_list, Iterable):
             # trigger making label encoder
             try:
-                next(example_list)
+                first_example = next(example_list)
             except StopIteration:
                 raise StopIteration(
                     'problem {} preproc fn returns empty data'.format(problem))
 
-            example_list = func(params, mode)
-            example_list = convert_legacy_output(example_list)
+            new_example_list = func(params, mode)
+            # one-shot iterator, e.g. file object, cannot be re-created
+            if new_example_list is example_list:
+                new_example_list = chain([first_example], example_list)
+            example_list = convert_legacy_output(new_example_list)
 
             # create label encoder
             if mode != PREDICT:
@@ -96,7 +96,8 @@ def masklm_get_or_make_label_encoder_fn(params: BaseParams, problem: str, mode:
 
     if need_make_label_encoder(mode=mode, le_path=le_path, overwrite=kwargs['overwrite']):
         # fit and save label encoder
-        label_encoder = load_transformer_tokenizer(params.transformer_tokenizer_name, params.transformer_tokenizer_loading)
+        label_encoder = load_transformer_tokenizer(
+            params.transformer_tokenizer_name, params.transformer_tokenizer_loading, use_fast=False)
         pickle.dump(label_encoder, open(le_path, 'wb'))
         try:
             params.set_problem_info(problem=problem, info_name='num_classes', info=len(label_encoder.vocab))
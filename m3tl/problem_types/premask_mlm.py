@@ -86,7 +86,7 @@ class PreMaskMLM(tf.keras.Model):
 
 # Cell
 def premask_mlm_get_or_make_label_encoder_fn(params: BaseParams, problem, mode, label_list, *args, **kwargs):
-    tok = load_transformer_tokenizer(tokenizer_name=params.transformer_tokenizer_name, load_module_name=params.transformer_tokenizer_loading)
+    tok = load_transformer_tokenizer(tokenizer_name=params.transformer_tokenizer_name, load_module_name=params.transformer_tokenizer_loading, use_fast=params.use_fast_tokenizer)
     params.set_problem_info(problem=problem, info_name='num_classes', info=params.bert_config.vocab_size)
     return tok
 
@@ -96,7 +96,7 @@ def seq2seq_text_get_or_make_label_encoder_fn(params: BaseParams, problem: str,
     if need_make_label_encoder(mode=mode, le_path=le_path, overwrite=kwargs['overwrite']):
         # fit and save label encoder
         label_encoder = load_transformer_tokenizer(
-            params.transformer_decoder_tokenizer_name, params.transformer_decoder_tokenizer_loading)
+            params.transformer_decoder_tokenizer_name, params.transformer_decoder_tokenizer_loading, use_fast=False)
         pickle.dump(label_encoder, open(le_path, 'wb'))
         params.set_problem_info(problem=problem, info_name='num_classes', info=len(label_encoder.encode_dict))
     else:
@@ -157,7 +157,6 @@ def seq_tag_label_handling_fn(target, label_encoder=None, tokenizer=None, decodi
         raise ValueError(
             'Length is different for seq tag problem, inputs: {}'.format(tokenizer.decode(tokenized_inputs['input_ids'])))
 
-    label_id = label_encoder.transform(target).tolist()
-    label_id = [np.int32(i) for i in label_id]
+    label_id = list(label_encoder.transform(target).astype(np.int32))
     return label_id, None
 
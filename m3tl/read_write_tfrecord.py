@@ -1,26 +1,38 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: source_nbs/06_read_write_tfrecord.ipynb (unless otherwise specified).
 
 __all__ = ['serialize_fn', 'make_tfrecord_local', 'make_tfrecord_pyspark', 'make_tfrecord', 'chain_processed_data',
-           'write_tfrecord', 'make_feature_desc', 'reshape_tensors_in_dataset', 'add_loss_multiplier',
-           'set_shape_for_dataset', 'get_dummy_features', 'add_dummy_features_to_dataset', 'read_tfrecord']
+           'get_seq_length', 'read_length_histogram', 'make_tfrecord_cache_manifest', 'is_tfrecord_cache_valid',
+           'write_tfrecord', 'make_feature_desc', 'reshape_tensors_in_dataset', 'decode_dense_tensors_in_dataset',
+           'add_loss_multiplier', 'set_shape_for_dataset', 'parse_batched_example', 'get_dummy_features',
+           'add_dummy_features_to_dataset', 'ragged_to_dense_in_dataset', 'add_dummy_features_to_batched_dataset',
+           'read_tfrecord']
 
 # Cell
+import hashlib
+import heapq
+import inspect
 import json
 import os
+import pickle
+import shutil
 from fastcore.basics import partial
 from glob import glob
-from typing import Dict, Iterator, Callable
+from itertools import groupby, zip_longest
+from operator import itemgetter
+from typing import Dict, Iterator, Callable, List
 import tempfile
+from collections import Counter, defaultdict
 
 from loguru import logger
 import numpy as np
 import tensorflow as tf
-from fastcore.basics import listify
+from fastcore.basics import chunked, listify
+from joblib import Parallel, delayed
 
 from .bert_preprocessing.create_bert_features import create_multimodal_bert_features
 from .special_tokens import EVAL, TRAIN
 from .params import Params
-from .utils import get_is_pyspark
+from .utils import get_is_pyspark, get_tokenizer_fingerprint, load_transformer_tokenizer
 
 
 # Cell
@@ -53,7 +65,106 @@ def _bytes_list_feature(value):
     return tf.train.Feature(bytes_list=tf.train.BytesList(value=value))
 
 
-def serialize_fn(features: dict, return_feature_desc=False):
+# fixed byte order so that records can be decoded on any host
+_LITTLE_ENDIAN_DTYPE = {
+    'int64': '<i8',
+    'float32': '<f4',
+    'int32': '<i4',
+    'int16': '<i2',
+    'uint16': '<u2',
+    'uint8': '<u1'
+}
+
+
+def _get_shape_value(feature: np.ndarray) -> list:
+    # this seems not a good idea
+    if len(feature.shape) > 1:
+        return [None] + list(feature.shape[1:])
+    return [None for _ in feature.shape]
+
+
+def _get_storage_dtype(feature_name: str, storage_dtype: Dict[str, str] = None) -> str:
+    if not storage_dtype:
+        return 'int64'
+    if feature_name in storage_dtype:
+        return storage_dtype[feature_name]
+    for suffix, dtype in storage_dtype.items():
+        if feature_name.endswith(suffix):
+            return dtype
+    return 'int64'
+
+
+def _serialize_dense_features(features: dict, storage_dtype: Dict[str, str] = None):
+    """Serialize every feature as a single little-endian bytes blob.
+
+    Static shape is carried in feature desc, so reading only needs
+    `decode_raw` and `reshape` without sparse ops. Integer features
+    can be stored with narrower dtype specified by `storage_dtype`.
+    """
+    features_tuple = {}
+    feature_desc = {'tfrecord_encoding': 'dense'}
+    narrow_dtype_dict = {}
+    for feature_name, feature in features.items():
+        if isinstance(feature, str):
+            feature = feature.encode('utf8')
+        if isinstance(feature, bytes):
+            features_tuple[feature_name] = _bytes_feature(feature)
+            feature_desc[feature_name] = 'string'
+            feature_desc['{}_shape_value'.format(feature_name)] = []
+            continue
+
+        feature = np.asarray(feature)
+        if issubclass(feature.dtype.type, np.integer):
+            feature_type = 'int64'
+            feature_storage_dtype = _get_storage_dtype(
+                feature_name, storage_dtype)
+        else:
+            feature_type = 'float32'
+            feature_storage_dtype = 'float32'
+
+        if feature_storage_dtype != feature_type:
+            dtype_info = np.iinfo(feature_storage_dtype)
+            if feature.size and (feature.min() < dtype_info.min or feature.max() > dtype_info.max):
+                raise ValueError('feature {} has values out of range of storage dtype {}: [{}, {}]'.format(
+                    feature_name, feature_storage_dtype, feature.min(), feature.max()))
+            narrow_dtype_dict[feature_name] = feature_storage_dtype
+
+        features_tuple[feature_name] = _bytes_feature(
+            feature.astype(_LITTLE_ENDIAN_DTYPE[feature_storage_dtype]).tobytes())
+        feature_desc[feature_name] = feature_type
+        feature_desc['{}_shape_value'.format(
+            feature_name)] = _get_shape_value(feature)
+
+    if narrow_dtype_dict:
+        feature_desc['tfrecord_storage_dtype'] = narrow_dtype_dict
+
+    example_proto = tf.train.Example(
+        features=tf.train.Features(feature=features_tuple)).SerializeToString()
+    return example_proto, feature_desc
+
+
+def serialize_fn(features: dict, return_feature_desc=False, encoding='var_len', storage_dtype: Dict[str, str] = None):
+    """Serialize features dict to tf example string
+
+    Args:
+        features (dict): features dict
+        return_feature_desc (bool, optional): whether to return feature desc as well. Defaults to False.
+        encoding (str, optional): 'var_len' or 'dense'. 'var_len' writes flat int64/float lists
+            with a shape feature, 'dense' writes one raw bytes feature per tensor. Defaults to 'var_len'.
+        storage_dtype (Dict[str, str], optional): only for dense encoding. storage dtype of integer
+            features, keys are feature names or suffixes of feature names, e.g. {'_mask': 'uint8'}.
+            Features will be cast back to int64 when reading. Defaults to None.
+    """
+    if encoding == 'dense':
+        example_proto, feature_desc = _serialize_dense_features(
+            features, storage_dtype=storage_dtype)
+        if return_feature_desc:
+            return example_proto, feature_desc
+        return example_proto
+    elif encoding != 'var_len':
+        raise ValueError(
+            'encoding should be one of var_len, dense, got: {}'.format(encoding))
+
     features_tuple = {}
     feature_desc = {}
     for feature_name, feature in features.items():
@@ -72,18 +183,10 @@ def serialize_fn(features: dict, return_feature_desc=False):
 
             features_tuple['{}_shape'.format(
                 feature_name)] = _int64_list_feature(feature.shape)
-            feature_desc['{}_shape_value'.format(feature_name)] = feature.shape
-
             feature_desc['{}_shape'.format(
                 feature_name)] = 'int64'
-
-            # this seems not a good idea
-            if len(feature.shape) > 1:
-                feature_desc['{}_shape_value'.format(feature_name)] = [
-                    None] + list(feature.shape[1:])
-            else:
-                feature_desc['{}_shape_value'.format(feature_name)] = [
-                    None for _ in feature.shape]
+            feature_desc['{}_shape_value'.format(
+                feature_name)] = _get_shape_value(feature)
 
         elif np.issubdtype(type(feature), np.float):
             features_tuple[feature_name] = _float_feature(feature)
@@ -123,49 +226,68 @@ def serialize_fn(features: dict, return_feature_desc=False):
 
 
 # Cell
-def make_tfrecord_local(data_list, output_dir, serialize_fn, mode='train', example_per_file=100000, prefix='', **kwargs) -> int:
+def _merge_feature_desc(ld: dict, rd: dict) -> dict:
+    for k, v in rd.items():
+        # storage dtype of dense encoding is nested dict
+        if isinstance(v, dict):
+            ld[k] = {**ld.get(k, {}), **v}
+        else:
+            ld[k] = v
+    return ld
+
+
+def _write_shard_fn(d_list, path, serialize_fn, compression_type=''):
+    """serialize and write one shard, return number of records and feature desc of the shard"""
+    logger.debug('Writing {}'.format(path))
+    feature_desc = {}
+    with tf.io.TFRecordWriter(path, options=tf.io.TFRecordOptions(compression_type=compression_type)) as writer:
+        for features in d_list:
+            example, example_feature_desc = serialize_fn(
+                features, return_feature_desc=True)
+            writer.write(example)
+            _merge_feature_desc(feature_desc, example_feature_desc)
+    return len(d_list), feature_desc
+
+
+def make_tfrecord_local(data_list, output_dir, serialize_fn, mode='train', example_per_file=100000, prefix='',
+                        num_cpus=1, compression_type=None, **kwargs) -> int:
     """
     make tf record and return total number of records
+
+    Every shard is serialized and written by one of `num_cpus` processes.
+    Feature desc of all shards are merged and written at the end.
+    If `compression_type` is 'GZIP' or 'ZLIB', shards are compressed and
+    the codec is recorded in feature desc.
     """
+    # validate before spawning writers
+    compression_type = tf.io.TFRecordOptions.get_compression_type_string(
+        compression_type)
     # create output tfrecord path
     os.makedirs(os.path.join(
         output_dir, prefix), exist_ok=True)
 
-    def _write_fn(d_list, path, serialize_fn, mode='train'):
-        logger.debug('Writing {}'.format(path))
-        feature_desc_path = os.path.join(os.path.dirname(
-            path), '{}_feature_desc.json'.format(mode))
-
-        with tf.io.TFRecordWriter(path) as writer:
-            for features in d_list:
-                example, feature_desc = serialize_fn(
-                    features, return_feature_desc=True)
-                writer.write(example)
-                if not os.path.exists(feature_desc_path):
-                    json.dump(feature_desc, open(
-                        feature_desc_path, 'w', encoding='utf8'))
+    def _shard_path(shard_count):
+        return os.path.join(
+            output_dir, prefix, '{}_{:05d}.tfrecord'.format(mode, shard_count))
 
-    _write_part_fn = partial(_write_fn, serialize_fn=serialize_fn, mode=mode)
+    res_list = Parallel(num_cpus)(
+        delayed(_write_shard_fn)(d_list=d_list, path=_shard_path(shard_count),
+                                 serialize_fn=serialize_fn, compression_type=compression_type)
+        for shard_count, d_list in enumerate(chunked(data_list, chunk_sz=example_per_file)))
 
-    x = []
     total_count = 0
-    shard_count = 0
-    for idx, example in enumerate(data_list):
-        total_count += 1
-        x.append(example)
-        if idx % example_per_file == 0 and idx:  # pragma: no cover
-            path = os.path.join(
-                output_dir, prefix, '{}_{:05d}.tfrecord'.format(mode, shard_count))
-            shard_count += 1
-            _write_part_fn(d_list=x, path=path)
-            x = []
-
-    # add remaining
-    if x:
-        path = os.path.join(
-            output_dir, prefix, '{}_{:05d}.tfrecord'.format(mode, shard_count))
-        _write_part_fn(d_list=x, path=path)
-        total_count += len(x)
+    feature_desc = {}
+    for shard_record_count, shard_feature_desc in res_list:
+        total_count += shard_record_count
+        _merge_feature_desc(feature_desc, shard_feature_desc)
+
+    if feature_desc:
+        if compression_type:
+            feature_desc['tfrecord_compression'] = compression_type
+        feature_desc_path = os.path.join(
+            output_dir, prefix, '{}_feature_desc.json'.format(mode))
+        json.dump(feature_desc, open(
+            feature_desc_path, 'w', encoding='utf8'))
     return total_count
 
 
@@ -176,6 +298,10 @@ def make_tfrecord_pyspark(data_list, output_dir: str, serialize_fn: Callable, mo
     from .pyspark_utils import Hdfs, repar_rdd
     from pyspark import RDD
 
+    if kwargs.get('compression_type'):
+        logger.warning(
+            'TFRecord compression is not supported with pyspark, writing uncompressed TFRecord.')
+
     # write RDD to TFRecords
     # ref: https://github.com/yahoo/TensorFlowOnSpark/blob/master/examples/mnist/mnist_data_setup.py
     # just for type hint
@@ -208,10 +334,7 @@ def make_tfrecord_pyspark(data_list, output_dir: str, serialize_fn: Callable, mo
     )
 
     # create feature desc
-    def _update_dict(ld: dict, rd: dict) -> dict:
-        ld.update(rd)
-        return ld
-    feature_desc = feature_desc_pair_rdd.reduceByKeyLocally(_update_dict)[0]
+    feature_desc = feature_desc_pair_rdd.reduceByKeyLocally(_merge_feature_desc)[0]
 
     local_feature_desc_path = '{}_feature_desc.json'.format(mode)
     json.dump(feature_desc, open(local_feature_desc_path, 'w'), indent=4)
@@ -243,7 +366,108 @@ def make_tfrecord(data_list, output_dir, serialize_fn, mode='train', example_per
 
 # Cell
 
-def chain_processed_data(problem_preproc_gen_dict: Dict[str, Iterator]) -> Iterator:
+def _add_loss_multiplier(inp: dict, problem: str) -> dict:
+    inp['{}_loss_multiplier'.format(problem)] = 1
+    return inp
+
+
+def _make_record_id_key(problem: str):
+    def _get_record_id(inp: dict):
+        if 'record_id' not in inp:
+            raise KeyError(
+                "Chaining problems of {} on record_id without "
+                "providing 'record_id' in inputs. Received keys: {}".format(problem, inp.keys()))
+        return inp['record_id']
+    return _get_record_id
+
+
+def _write_sorted_runs(data_iter: Iterator, problem: str, run_dir: str, run_size: int) -> List[str]:
+    """Sort records by record_id in chunks of `run_size` and pickle every chunk to disk"""
+    get_record_id = _make_record_id_key(problem)
+    run_path_list = []
+    for run in chunked(data_iter, chunk_sz=run_size):
+        run_path = os.path.join(
+            run_dir, '{}_{:05d}.pkl'.format(problem, len(run_path_list)))
+        with open(run_path, 'wb') as f:
+            for d in sorted(run, key=get_record_id):
+                pickle.dump(_add_loss_multiplier(d, problem), f,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+        run_path_list.append(run_path)
+    return run_path_list
+
+
+def _read_sorted_run(run_path: str) -> Iterator[dict]:
+    with open(run_path, 'rb') as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+def _merge_on_record_id(problem_preproc_gen_dict: Dict[str, Iterator], run_size=100000, tmp_dir: str = None) -> Iterator[dict]:
+    """Outer join problems on record_id with external sort-merge.
+
+    Same as `m3tl.pyspark_utils.join_dict_of_rdd`, loss multiplier of
+    every problem is set according to whether the problem has the record.
+    """
+    loss_multiplier_list = ['{}_loss_multiplier'.format(
+        p) for p in problem_preproc_gen_dict]
+    if tmp_dir is not None:
+        os.makedirs(tmp_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as run_dir:
+        sorted_run_list = []
+        for problem, data_iter in problem_preproc_gen_dict.items():
+            sorted_run_list += [_read_sorted_run(run_path) for run_path in _write_sorted_runs(
+                data_iter, problem, run_dir, run_size)]
+
+        merged_iter = heapq.merge(
+            *sorted_run_list, key=itemgetter('record_id'))
+        for _, record_group in groupby(merged_iter, key=itemgetter('record_id')):
+            d = {}
+            for record in record_group:
+                d.update(record)
+            for loss_multiplier_name in loss_multiplier_list:
+                if loss_multiplier_name not in d:
+                    d[loss_multiplier_name] = 0
+            yield d
+
+
+def _lock_step_merge(problem_preproc_gen_dict: Dict[str, Iterator]) -> Iterator[dict]:
+    """Merge problems record by record, records of every problem should be aligned"""
+    problem_list = list(problem_preproc_gen_dict.keys())
+    join_key = None
+    for record_count, record_tuple in enumerate(zip_longest(*problem_preproc_gen_dict.values())):
+        for pro, record in zip(problem_list, record_tuple):
+            if record is None:
+                raise IndexError('Problem {} has {} records, while other problems have more.'.format(
+                    pro, record_count))
+        # get intersection and use as ensure features are the same
+        if join_key is None:
+            join_key = list(set(record_tuple[0].keys()).intersection(
+                *[r.keys() for r in record_tuple[1:]]))
+
+        d = record_tuple[0]
+        for record in record_tuple[1:]:
+            for k in join_key:
+                assert d[k] == record[k], 'At iteration {}, feature {} not align. Expected {}, got: {}'.format(
+                    record_count, k, d[k], record[k]
+                )
+            d.update(record)
+        yield d
+
+    if join_key is None:
+        raise IndexError("Problem {} has no data".format(problem_list[0]))
+
+
+def chain_processed_data(problem_preproc_gen_dict: Dict[str, Iterator], join_on_record_id=False, run_size=100000, tmp_dir: str = None) -> Iterator:
+    """Chain features of problems in the same problem chunk.
+
+    Records are merged lazily in lock-step by default, i-th record of every
+    problem should describe the same inputs. If `join_on_record_id` is True,
+    records are outer joined on record_id with an external sort-merge, which
+    keeps at most `run_size` records of a problem in memory.
+    """
     # problem chunk size is 1, return generator directly
     if len(problem_preproc_gen_dict) == 1:
         return next(iter(problem_preproc_gen_dict.values()))
@@ -255,35 +479,127 @@ def chain_processed_data(problem_preproc_gen_dict: Dict[str, Iterator]) -> Itera
         rdd = join_dict_of_rdd(rdd_dict=problem_preproc_gen_dict)
         return rdd
 
-    logger.warning('Chaining problems with & may consume a lot of memory if'
-                   ' data is not pyspark RDD.')
-    data_dict = {}
-    column_list = []
-    for pro in problem_preproc_gen_dict:
-        data_dict[pro] = listify(problem_preproc_gen_dict[pro])
-        try:
-            column_list.append(list(data_dict[pro][0].keys()))
-        except IndexError:
-            raise IndexError("Problem {} has no data".format(pro))
-
-    # get intersection and use as ensure features are the same
-    join_key = list(set(column_list[0]).intersection(*column_list[1:]))
-
-    flat_data_list = []
-    first_problem = next(iter(problem_preproc_gen_dict.keys()))
-    while data_dict[first_problem]:
-        d = {}
-        for pro in data_dict:
-            if not d:
-                d = data_dict[pro].pop(0)
-            else:
-                for k in join_key:
-                    assert d[k] == data_dict[pro][0][k], 'At iteration {}, feature {} not align. Expected {}, got: {}'.format(
-                        len(flat_data_list), k, d[k], data_dict[pro][0][k]
-                    )
-                d.update(data_dict[pro].pop(0))
-        flat_data_list.append(d)
-    return flat_data_list
+    if join_on_record_id:
+        return _merge_on_record_id(problem_preproc_gen_dict, run_size=run_size, tmp_dir=tmp_dir)
+    return _lock_step_merge(problem_preproc_gen_dict)
+
+
+def get_seq_length(features: dict) -> int:
+    """Sequence length of a record, same as `m3tl.input_fn.element_length_func`"""
+    return sum([len(v) for k, v in features.items() if 'input_ids' in k])
+
+
+def _count_seq_length(data_iter: Iterator[dict], length_counter_dict: Dict[str, Counter]) -> Iterator[dict]:
+    for d in data_iter:
+        length_counter_dict['total'][get_seq_length(d)] += 1
+        for k, v in d.items():
+            if 'input_ids' in k:
+                length_counter_dict[k][len(v)] += 1
+        yield d
+
+
+def _get_length_histogram_path(file_dir: str, mode: str) -> str:
+    return os.path.join(file_dir, '{}_length_histogram.json'.format(mode))
+
+
+def read_length_histogram(file_dir: str, mode: str) -> Dict[str, Counter]:
+    """Read length histogram written by `write_tfrecord`.
+
+    Keys are 'total', which is the length used for bucketing, and
+    every `*input_ids` feature. Values are Counter of length to count.
+    """
+    with open(_get_length_histogram_path(file_dir, mode), 'r', encoding='utf8') as f:
+        histogram_dict = json.load(f)
+    return {k: Counter({length: count for length, count in histogram})
+            for k, histogram in histogram_dict.items()}
+
+
+# params that change the content of tfrecord. tokenizer names are rewritten
+# to checkpoint dir, tokenizers are fingerprinted by content instead
+_TFRECORD_CACHE_PARAMS = [
+    'transformer_tokenizer_loading', 'transformer_decoder_tokenizer_loading',
+    'max_seq_len', 'decode_max_seq_len', 'masked_lm_prob', 'max_predictions_per_seq',
+    'dupe_factor', 'short_seq_prob', 'example_per_file', 'chain_problem_on_record_id',
+    'tfrecord_encoding', 'tfrecord_storage_dtype', 'tfrecord_compression'
+]
+
+
+def _get_fn_fingerprint(fn: Callable) -> str:
+    fn = inspect.unwrap(fn)
+    try:
+        fn_str = inspect.getsource(fn)
+    except (OSError, TypeError):
+        # source not available, e.g. defined in interactive session
+        fn_str = '{}.{}'.format(getattr(fn, '__module__', None), getattr(
+            fn, '__qualname__', repr(fn)))
+    return hashlib.md5(fn_str.encode('utf8')).hexdigest()
+
+
+def _get_input_files_fingerprint(path_list: List[str]) -> Dict[str, list]:
+    file_fingerprint = {}
+    for pattern in listify(path_list):
+        for path in sorted(glob(pattern)):
+            stat = os.stat(path)
+            file_fingerprint[path] = [stat.st_size, stat.st_mtime_ns]
+    return file_fingerprint
+
+
+def _get_tokenizer_fingerprint_dict(params: Params) -> Dict[str, str]:
+    fingerprint_dict = {}
+    for name in ['transformer_tokenizer', 'transformer_decoder_tokenizer']:
+        tokenizer_name = params.get('{}_name'.format(name))
+        if tokenizer_name:
+            fingerprint_dict[name] = get_tokenizer_fingerprint(load_transformer_tokenizer(
+                tokenizer_name, params.get('{}_loading'.format(name)), use_fast=False))
+    return fingerprint_dict
+
+
+def make_tfrecord_cache_manifest(params: Params, problem_list: List[str]) -> dict:
+    """Make cache manifest of a problem chunk.
+
+    Manifest contains source of preproc fns, params that affect
+    features, content fingerprint of tokenizers and size and mtime of
+    `params.preproc_input_files`. Tokenizer paths are not part of the
+    manifest, so runs with different model dirs share the cache.
+    Chunk will be rebuilt by `write_tfrecord` if fingerprint changes.
+    """
+    problem_list = sorted(problem_list)
+    manifest = {
+        'preproc_fn': {p: _get_fn_fingerprint(params.read_data_fn[p]) for p in problem_list},
+        'problem_type': {p: params.problem_type[p] for p in problem_list},
+        'params': {k: params.get(k) for k in _TFRECORD_CACHE_PARAMS},
+        'tokenizer': _get_tokenizer_fingerprint_dict(params),
+        'input_files': {p: _get_input_files_fingerprint(params.preproc_input_files.get(p, [])) for p in problem_list}
+    }
+    manifest['fingerprint'] = hashlib.md5(json.dumps(
+        manifest, sort_keys=True).encode('utf8')).hexdigest()
+    return manifest
+
+
+def _get_cache_manifest_path(file_dir: str) -> str:
+    return os.path.join(file_dir, 'tfrecord_cache_manifest.json')
+
+
+def is_tfrecord_cache_valid(file_dir: str, manifest: dict) -> bool:
+    manifest_path = _get_cache_manifest_path(file_dir)
+    if not os.path.exists(manifest_path):
+        return False
+    with open(manifest_path, 'r', encoding='utf8') as f:
+        cached_manifest = json.load(f)
+    return cached_manifest.get('fingerprint') == manifest['fingerprint']
+
+
+def _remove_stale_tfrecord(file_dir: str):
+    for mode in [TRAIN, EVAL]:
+        stale_path_list = glob(os.path.join(
+            file_dir, '{}_*.tfrecord'.format(mode)))
+        stale_path_list.append(os.path.join(
+            file_dir, '{}_feature_desc.json'.format(mode)))
+        stale_path_list.append(_get_length_histogram_path(file_dir, mode))
+        for path in stale_path_list:
+            if os.path.exists(path):
+                os.remove(path)
+    shutil.rmtree(os.path.join(file_dir, 'snapshot'), ignore_errors=True)
 
 
 def write_tfrecord(params: Params, replace=False):
@@ -291,6 +607,9 @@ def write_tfrecord(params: Params, replace=False):
 
     Output location: params.tmp_file_dir
 
+    A problem chunk is only rebuilt if its cache manifest changes,
+    see `make_tfrecord_cache_manifest`.
+
     Arguments:
         params {params} -- params
 
@@ -300,6 +619,8 @@ def write_tfrecord(params: Params, replace=False):
 
     read_data_fn_dict = params.read_data_fn
     path_list = []
+    part_serialize_fn = partial(
+        serialize_fn, encoding=params.tfrecord_encoding, storage_dtype=params.tfrecord_storage_dtype)
     for problem_list in params.problem_chunk:
         problem_str = '_'.join(sorted(problem_list))
         file_dir = os.path.join(params.tmp_file_dir, problem_str)
@@ -307,7 +628,11 @@ def write_tfrecord(params: Params, replace=False):
             pyspark_dir = os.path.join(params.pyspark_output_path, problem_str)
         else:
             pyspark_dir = None
-        if not os.path.exists(file_dir) or replace:
+        manifest = make_tfrecord_cache_manifest(params, problem_list)
+        if replace or not is_tfrecord_cache_valid(file_dir, manifest):
+            if os.path.exists(file_dir):
+                logger.info('Rebuilding TFRecord of {}'.format(problem_str))
+                _remove_stale_tfrecord(file_dir)
             for mode in [TRAIN, EVAL]:
 
                 problem_preproc_gen_dict = {}
@@ -315,14 +640,33 @@ def write_tfrecord(params: Params, replace=False):
                     problem_preproc_gen_dict[p] = read_data_fn_dict[p](
                         params=params, mode=mode)
 
-                chained_data = chain_processed_data(problem_preproc_gen_dict)
+                chained_data = chain_processed_data(
+                    problem_preproc_gen_dict, join_on_record_id=params.chain_problem_on_record_id,
+                    run_size=params.preprocess_buffer, tmp_dir=params.tmp_file_dir)
+
+                # length histogram is used to get number of batches and
+                # bucketing config without reading tfrecord
+                length_counter_dict = defaultdict(Counter)
+                if not get_is_pyspark():
+                    chained_data = _count_seq_length(
+                        chained_data, length_counter_dict)
 
                 total_count = make_tfrecord(data_list=chained_data, output_dir=file_dir,
-                                            mode=mode, serialize_fn=serialize_fn, pyspark_dir=pyspark_dir,
-                                            example_per_file=params.example_per_file)
+                                            mode=mode, serialize_fn=part_serialize_fn, pyspark_dir=pyspark_dir,
+                                            example_per_file=params.example_per_file,
+                                            num_cpus=params.tfrecord_writer_num_cpus,
+                                            compression_type=params.tfrecord_compression)
                 if mode == TRAIN:
                     params.set_problem_info(
                         problem=problem_str, info_name='data_num', info=total_count)
+                if length_counter_dict:
+                    histogram_dict = {k: [[length, count] for length, count in sorted(counter.items())]
+                                      for k, counter in length_counter_dict.items()}
+                    params.set_problem_info(
+                        problem=problem_str, info_name='{}_length_histogram'.format(mode),
+                        info=histogram_dict['total'])
+                    with open(_get_length_histogram_path(file_dir, mode), 'w', encoding='utf8') as f:
+                        json.dump(histogram_dict, f)
 
                 if get_is_pyspark():
                     from .pyspark_utils import Hdfs, get_text_file_from_executor
@@ -334,11 +678,35 @@ def write_tfrecord(params: Params, replace=False):
                     Hdfs().copyFromLocalFile(local_problem_info_path, pyspark_dir)
 
 
-
+            # write manifest after all modes are written
+            os.makedirs(file_dir, exist_ok=True)
+            with open(_get_cache_manifest_path(file_dir), 'w', encoding='utf8') as f:
+                json.dump(manifest, f)
+        else:
+            logger.info(
+                'TFRecord of {} is up to date, skip writing'.format(problem_str))
 
 # Cell
+def _get_dense_storage_dtype(feature_desc_dict: dict, feature_name: str) -> str:
+    return feature_desc_dict.get('tfrecord_storage_dtype', {}).get(
+        feature_name, feature_desc_dict[feature_name])
+
+
 def make_feature_desc(feature_desc_dict: dict):
     feature_desc = {}
+    if feature_desc_dict.get('tfrecord_encoding') == 'dense':
+        for feature_name, feature_type in feature_desc_dict.items():
+            if feature_type not in ['int64', 'float32']:
+                continue
+            # missing features are filled with zeros, same as var_len encoding
+            default_shape = [1 if s is None else s for s in feature_desc_dict['{}_shape_value'.format(
+                feature_name)]]
+            storage_dtype = _get_dense_storage_dtype(
+                feature_desc_dict, feature_name)
+            feature_desc[feature_name] = tf.io.FixedLenFeature(
+                [], tf.string, default_value=np.zeros(default_shape, dtype=_LITTLE_ENDIAN_DTYPE[storage_dtype]).tobytes())
+        return feature_desc
+
     for feature_name, feature_type in feature_desc_dict.items():
         if feature_type == 'int64':
             feature_desc[feature_name] = tf.io.VarLenFeature(tf.int64)
@@ -348,6 +716,24 @@ def make_feature_desc(feature_desc_dict: dict):
     return feature_desc
 
 
+def _reshape_tensor(tensor: tf.Tensor, shape_tensor: tf.Tensor, shape_value: list) -> tf.Tensor:
+    """Reshape flat tensor to shape_tensor without data dependent branches
+
+    we need to fill tensor with zeros to make sure
+    that loss multiplier aligns with features correctly.
+    If the feature is missing, both tensor and shape_tensor are empty,
+    then shape_value from feature desc is used.
+    """
+    rank = len(shape_value)
+    shape_tensor = tf.cast(shape_tensor, tf.int32)
+    # shape_tensor is either of length rank or empty(missing feature)
+    shape = tf.concat(
+        [shape_tensor, tf.constant(shape_value, dtype=tf.int32, shape=[rank])], axis=0)[:rank]
+    padding = tf.zeros(
+        [tf.reduce_prod(shape) - tf.size(tensor)], dtype=tensor.dtype)
+    return tf.reshape(tf.concat([tensor, padding], axis=0), shape)
+
+
 def reshape_tensors_in_dataset(example, feature_desc_dict: dict):
     """Reshape serialized tensor back to its original shape
 
@@ -357,37 +743,14 @@ def reshape_tensors_in_dataset(example, feature_desc_dict: dict):
     Returns:
         Example -- Example
     """
-
-    for feature_key in example:
-        example[feature_key] = tf.sparse.to_dense(example[feature_key])
-
-    @tf.function
-    def _reshape_tensor(tensor: tf.Tensor, shape_tensor: tf.Tensor, shape_tensor_in_dict: tf.Tensor):
-        """
-        avoid empty tensor reshape error
-
-        we need to fill tensor with zeros to make sure
-        that loss multiplier aligns with features correctly
-        """
-        if tf.equal(tf.size(tensor), 0):
-            # scalar
-            if tf.equal(tf.size(shape_tensor), 0):
-                return tf.zeros(shape=shape_tensor_in_dict, dtype=tensor.dtype)
-            else:
-                return tf.zeros(shape=shape_tensor, dtype=tensor.dtype)
-
-        return tf.reshape(tensor, shape=shape_tensor)
-
-    for feature_key in example:
+    for feature_key in list(example.keys()):
         if '_shape' in feature_key:
             continue
-
-        shape_tensor = example['{}_shape'.format(feature_key)]
-        shape_tensor_in_dict = tf.convert_to_tensor(
-            feature_desc_dict[feature_key+'_shape_value'], dtype=tf.int32)
-
+        shape_key = '{}_shape'.format(feature_key)
         example[feature_key] = _reshape_tensor(
-            example[feature_key], shape_tensor, shape_tensor_in_dict)
+            tf.sparse.to_dense(example[feature_key]),
+            tf.sparse.to_dense(example[shape_key]),
+            feature_desc_dict['{}_value'.format(shape_key)])
 
     for feature_key in list(example.keys()):
         if '_shape' in feature_key:
@@ -396,6 +759,31 @@ def reshape_tensors_in_dataset(example, feature_desc_dict: dict):
     return example
 
 
+def decode_dense_tensors_in_dataset(example, feature_desc_dict: dict):
+    """Decode raw bytes written with dense encoding back to tensors
+
+    Arguments:
+        example {Example} -- Example parsed by `make_feature_desc`
+
+    Returns:
+        Example -- Example
+    """
+    for feature_key in example:
+        feature_type = feature_desc_dict[feature_key]
+        shape_value = feature_desc_dict['{}_shape_value'.format(feature_key)]
+        tensor = tf.io.decode_raw(
+            example[feature_key],
+            out_type=tf.as_dtype(_get_dense_storage_dtype(feature_desc_dict, feature_key)),
+            little_endian=True)
+        tensor = tf.cast(tensor, tf.as_dtype(feature_type))
+        if shape_value:
+            shape = [-1] + shape_value[1:]
+        else:
+            shape = []
+        example[feature_key] = tf.reshape(tensor, shape)
+    return example
+
+
 def add_loss_multiplier(example, problem):  # pragma: no cover
     loss_multiplier_name = '{}_loss_multiplier'.format(problem)
     if loss_multiplier_name not in example:
@@ -411,6 +799,84 @@ def set_shape_for_dataset(example, feature_desc_dict):  # pragma: no cover
     return example
 
 
+def _to_flat_ragged(tensor, shape_tensor, feature_type: str, default_shape: list, is_dense_encoding: bool,
+                    storage_dtype: str = None) -> tf.RaggedTensor:
+    """Convert a batch of parsed features to [batch_size, None] ragged tensor of flat values"""
+    if is_dense_encoding:
+        out_type = tf.as_dtype(storage_dtype or feature_type)
+        byte_length = tf.strings.length(tensor)
+        padded = tf.io.decode_raw(
+            tensor, out_type=out_type, little_endian=True,
+            fixed_length=tf.maximum(tf.reduce_max(byte_length), out_type.size))
+        padded = tf.cast(padded, tf.as_dtype(feature_type))
+        return tf.RaggedTensor.from_tensor(padded, lengths=byte_length // out_type.size)
+
+    flat = tf.RaggedTensor.from_sparse(tensor)
+    # fill missing features with zeros, same as reshape_tensors_in_dataset
+    default_size = int(np.prod(default_shape))
+    row_lengths = flat.row_lengths()
+    is_missing = tf.logical_and(
+        tf.equal(row_lengths, 0), tf.equal(shape_tensor.row_lengths(), 0))
+    row_lengths = tf.where(is_missing, tf.cast(
+        default_size, row_lengths.dtype), row_lengths)
+    padded = flat.to_tensor()
+    padded = tf.pad(padded, [[0, 0], [0, tf.maximum(
+        default_size - tf.shape(padded)[1], 0)]])
+    return tf.RaggedTensor.from_tensor(padded, lengths=row_lengths)
+
+
+def parse_batched_example(serialized, feature_desc: dict, feature_desc_dict: dict, problem_list: List[str]):
+    """Vectorized version of parse, reshape and add_loss_multiplier.
+
+    Parse a batch of serialized examples with `tf.io.parse_example`. Features
+    with dynamic first dimension are returned as ragged tensors, which should
+    be converted to dense tensors with `ragged_to_dense_in_dataset` after `unbatch`.
+
+    Arguments:
+        serialized {tf.Tensor} -- batch of serialized examples
+        feature_desc {dict} -- feature desc created by `make_feature_desc`
+        feature_desc_dict {dict} -- feature desc dict loaded from json
+        problem_list {List[str]} -- problems of the problem chunk
+
+    Returns:
+        dict -- batched example
+    """
+    batch_size = tf.shape(serialized)[0]
+    is_dense_encoding = feature_desc_dict.get(
+        'tfrecord_encoding') == 'dense'
+    example = tf.io.parse_example(serialized=serialized, features=feature_desc)
+    batched_example = {}
+    for feature_key in example:
+        if '_shape' in feature_key:
+            continue
+        shape_value = feature_desc_dict['{}_shape_value'.format(feature_key)]
+        default_shape = [1 if s is None else s for s in shape_value]
+        flat = _to_flat_ragged(
+            tensor=example[feature_key],
+            shape_tensor=None if is_dense_encoding else tf.RaggedTensor.from_sparse(
+                example['{}_shape'.format(feature_key)]),
+            feature_type=feature_desc_dict[feature_key],
+            default_shape=default_shape,
+            is_dense_encoding=is_dense_encoding,
+            storage_dtype=_get_dense_storage_dtype(
+                feature_desc_dict, feature_key) if is_dense_encoding else None)
+
+        if not shape_value:
+            batched_example[feature_key] = tf.reshape(flat.values, [batch_size])
+        else:
+            inner_shape = shape_value[1:]
+            batched_example[feature_key] = tf.RaggedTensor.from_row_lengths(
+                tf.reshape(flat.values, [-1] + inner_shape),
+                flat.row_lengths() // int(np.prod(inner_shape)))
+
+    for problem in problem_list:
+        loss_multiplier_name = '{}_loss_multiplier'.format(problem)
+        if loss_multiplier_name not in batched_example:
+            batched_example[loss_multiplier_name] = tf.ones(
+                [batch_size], dtype=tf.int32)
+    return batched_example
+
+
 def get_dummy_features(dataset_dict, feature_desc_dict):
     """Get dummy features.
     Dummy features are used to make sure every feature dict
@@ -475,12 +941,125 @@ def add_dummy_features_to_dataset(example, dummy_features):  # pragma: no cover
     return example
 
 
+def ragged_to_dense_in_dataset(example):  # pragma: no cover
+    """Convert ragged features of unbatched example back to dense tensors
+
+    Arguments:
+        example {data example} -- unbatched dataset example
+    """
+    return {feature_name: feature.to_tensor() if isinstance(feature, tf.RaggedTensor) else feature
+            for feature_name, feature in example.items()}
+
+
+def add_dummy_features_to_batched_dataset(example, dummy_features):  # pragma: no cover
+    """Batched version of `add_dummy_features_to_dataset`
+
+    Arguments:
+        example {data example} -- batched dataset example
+        dummy_features {dict} -- dict of dummy tensors
+    """
+    batch_size = tf.shape(next(iter(example.values())))[0]
+    for feature_name, dummy_feature in dummy_features.items():
+        if feature_name not in example:
+            example[feature_name] = tf.tile(
+                tf.expand_dims(dummy_feature, axis=0),
+                tf.concat([[batch_size], tf.ones_like(tf.shape(dummy_feature))], axis=0))
+    return example
+
+
+def _get_snapshot_path(params: Params, problem: str, mode: str, fingerprint_dict: dict) -> str:
+    """Snapshot path of decoded dataset, changes if tfrecord or feature desc of any chunk changes"""
+    if params.use_horovod:
+        import horovod.tensorflow.keras as hvd
+        fingerprint_dict['shard'] = [hvd.rank(), hvd.size()]
+    fingerprint = hashlib.md5(json.dumps(
+        fingerprint_dict, sort_keys=True).encode('utf8')).hexdigest()
+    return os.path.join(params.tmp_file_dir, problem, 'snapshot', '{}_{}'.format(mode, fingerprint))
+
+
+def _snapshot_dataset(dataset: tf.data.Dataset, snapshot_path: str, params: Params, shard_shuffle: bool, num_files: int) -> tf.data.Dataset:
+    """Snapshot decoded dataset
+
+    Snapshot is written in the order of the first pass. If `shard_shuffle`,
+    it is split to shards of `params.example_per_file` examples, and shards
+    are shuffled and interleaved when reading like tfrecord files, so that
+    the order still changes every epoch.
+    """
+    if not shard_shuffle:
+        return dataset.apply(tf.data.experimental.snapshot(snapshot_path))
+
+    def reader_func(datasets):
+        return datasets.shuffle(num_files).interleave(
+            lambda x: x,
+            cycle_length=params.shard_shuffle_cycle_length,
+            num_parallel_calls=tf.data.experimental.AUTOTUNE,
+            deterministic=False)
+    return dataset.enumerate().apply(tf.data.experimental.snapshot(
+        snapshot_path,
+        shard_func=lambda idx, _: idx // params.example_per_file,
+        reader_func=reader_func)).map(lambda _, x: x)
+
+
+def _make_tfrecord_dataset(params: Params, tfrecord_path_list: List[str], compression_type: str, mode: str) -> tf.data.Dataset:
+    """Create serialized example dataset from tfrecord files
+
+    If `params.shuffle_mode` is 'shard', train files are shuffled and
+    interleaved instead of being read in order.
+    """
+    if params.shuffle_mode not in ['element', 'shard']:
+        raise ValueError('shuffle_mode should be one of element, shard, got: {}'.format(
+            params.shuffle_mode))
+    shard_shuffle = mode == TRAIN and params.shuffle_mode == 'shard'
+
+    # when using hvd, we need to shard dataset
+    shard_files = False
+    if params.use_horovod:
+        import horovod.tensorflow.keras as hvd
+        # files are shuffled independently on each worker, shard
+        # files so that workers don't read the same examples
+        shard_files = shard_shuffle and len(tfrecord_path_list) >= hvd.size()
+        if shard_shuffle and not shard_files:
+            logger.warning('Number of tfrecord files {} less than number of workers {}, files will not be shuffled'.format(
+                len(tfrecord_path_list), hvd.size()))
+            shard_shuffle = False
+
+    if not shard_shuffle:
+        dataset = tf.data.TFRecordDataset(
+            tfrecord_path_list,
+            compression_type=compression_type,
+            num_parallel_reads=tf.data.experimental.AUTOTUNE)
+        if params.use_horovod:
+            dataset = dataset.shard(hvd.size(), hvd.rank())
+        return dataset
+
+    file_dataset = tf.data.Dataset.from_tensor_slices(sorted(tfrecord_path_list))
+    if shard_files:
+        file_dataset = file_dataset.shard(hvd.size(), hvd.rank())
+    file_dataset = file_dataset.shuffle(len(tfrecord_path_list))
+    return file_dataset.interleave(
+        lambda path: tf.data.TFRecordDataset(
+            path, compression_type=compression_type),
+        cycle_length=params.shard_shuffle_cycle_length,
+        num_parallel_calls=tf.data.experimental.AUTOTUNE,
+        deterministic=False)
+
+
 def read_tfrecord(params: Params, mode: str):
     """Read and parse TFRecord for every problem
 
     The returned dataset is parsed, reshaped, to_dense tensors
     with dummy features.
 
+    If `params.tfrecord_parse_batch_size` is set, serialized examples are
+    batched and parsed with `parse_batched_example` then unbatched.
+
+    If `params.shuffle_mode` is 'shard', train tfrecord files are shuffled
+    and interleaved.
+
+    If `params.tfrecord_snapshot` is set, decoded datasets are snapshotted
+    under tmp_file_dir at the first pass and read from snapshot afterwards.
+    In 'shard' shuffle mode, shards of snapshot are shuffled every epoch.
+
     Arguments:
         params {params} -- params
         mode {str} -- mode, train, eval or predict
@@ -490,6 +1069,7 @@ def read_tfrecord(params: Params, mode: str):
     """
     dataset_dict = {}
     all_feature_desc_dict = {}
+    snapshot_fingerprint_dict = {}
     for problem_list in params.problem_chunk:
         problem = '_'.join(sorted(problem_list))
         file_dir = os.path.join(params.tmp_file_dir, problem)
@@ -508,30 +1088,45 @@ def read_tfrecord(params: Params, mode: str):
             feature_desc_dict = json.load(
                 open(os.path.join(file_dir, '{}_feature_desc.json'.format(mode))))
         all_feature_desc_dict.update(feature_desc_dict)
+        snapshot_fingerprint_dict[problem] = {
+            'feature_desc': feature_desc_dict,
+            'tfrecord': sorted([[path, os.path.getmtime(path)] for path in tfrecord_path_list])
+        }
         feature_desc = make_feature_desc(feature_desc_dict)
-        dataset = tf.data.TFRecordDataset(
-            tfrecord_path_list, num_parallel_reads=tf.data.experimental.AUTOTUNE)
-        # when using hvd, we need to shard dataset
-        if params.use_horovod:
-            import horovod.tensorflow.keras as hvd
-            dataset = dataset.shard(hvd.size(), hvd.rank())
-        dataset = dataset.map(lambda x: tf.io.parse_single_example(
-            serialized=x, features=feature_desc), num_parallel_calls=tf.data.experimental.AUTOTUNE)
-        feature_desc_dict_replace_none = {}
-        for name, desc in feature_desc_dict.items():
-            if not isinstance(desc, list):
-                feature_desc_dict_replace_none[name] = desc
-            else:
-                desc_without_none = [i if i is not None else 1 for i in desc]
-                feature_desc_dict_replace_none[name] = desc_without_none
-
-        dataset = dataset.map(
-            lambda x: reshape_tensors_in_dataset(x, feature_desc_dict_replace_none),
-            num_parallel_calls=tf.data.experimental.AUTOTUNE).map(  # pylint: disable=no-member
-            lambda x: set_shape_for_dataset(
-                x, feature_desc_dict),
-            num_parallel_calls=tf.data.experimental.AUTOTUNE  # pylint: disable=no-member
-        )
+        dataset = _make_tfrecord_dataset(
+            params, tfrecord_path_list,
+            compression_type=feature_desc_dict.get('tfrecord_compression', ''), mode=mode)
+        if params.tfrecord_parse_batch_size:
+            dataset = dataset.batch(params.tfrecord_parse_batch_size).map(
+                lambda x: parse_batched_example(
+                    x, feature_desc, feature_desc_dict, problem_list),
+                num_parallel_calls=tf.data.experimental.AUTOTUNE)
+            dataset_dict[problem] = dataset
+            continue
+        elif feature_desc_dict.get('tfrecord_encoding') == 'dense':
+            # shape is static in feature desc, no sparse ops needed
+            dataset = dataset.map(
+                lambda x: decode_dense_tensors_in_dataset(tf.io.parse_single_example(
+                    serialized=x, features=feature_desc), feature_desc_dict),
+                num_parallel_calls=tf.data.experimental.AUTOTUNE)
+        else:
+            dataset = dataset.map(lambda x: tf.io.parse_single_example(
+                serialized=x, features=feature_desc), num_parallel_calls=tf.data.experimental.AUTOTUNE)
+            feature_desc_dict_replace_none = {}
+            for name, desc in feature_desc_dict.items():
+                if not isinstance(desc, list):
+                    feature_desc_dict_replace_none[name] = desc
+                else:
+                    desc_without_none = [i if i is not None else 1 for i in desc]
+                    feature_desc_dict_replace_none[name] = desc_without_none
+
+            dataset = dataset.map(
+                lambda x: reshape_tensors_in_dataset(x, feature_desc_dict_replace_none),
+                num_parallel_calls=tf.data.experimental.AUTOTUNE).map(  # pylint: disable=no-member
+                lambda x: set_shape_for_dataset(
+                    x, feature_desc_dict),
+                num_parallel_calls=tf.data.experimental.AUTOTUNE  # pylint: disable=no-member
+            )
         for p in problem_list:
             dataset = dataset.map(lambda x: add_loss_multiplier(x, p),
                                   num_parallel_calls=tf.data.experimental.AUTOTUNE)
@@ -540,8 +1135,27 @@ def read_tfrecord(params: Params, mode: str):
     # add dummy features
     dummy_features = get_dummy_features(dataset_dict, all_feature_desc_dict)
     for idx, problem in enumerate(params.get_problem_chunk(as_str=True)):
-        dataset_dict[problem] = dataset_dict[problem].map(
-            lambda x: add_dummy_features_to_dataset(x, dummy_features),
-            num_parallel_calls=tf.data.experimental.AUTOTUNE
-        )
+        if params.tfrecord_parse_batch_size:
+            dataset_dict[problem] = dataset_dict[problem].map(
+                lambda x: add_dummy_features_to_batched_dataset(x, dummy_features),
+                num_parallel_calls=tf.data.experimental.AUTOTUNE
+            ).unbatch().map(ragged_to_dense_in_dataset,
+                            num_parallel_calls=tf.data.experimental.AUTOTUNE)
+        else:
+            dataset_dict[problem] = dataset_dict[problem].map(
+                lambda x: add_dummy_features_to_dataset(x, dummy_features),
+                num_parallel_calls=tf.data.experimental.AUTOTUNE
+            )
+        if params.tfrecord_snapshot:
+            shard_shuffle = mode == TRAIN and params.shuffle_mode == 'shard'
+            # dummy features depend on all chunks
+            snapshot_path = _get_snapshot_path(params, problem, mode, {
+                'problem_chunk': problem, 'mode': mode,
+                'chunk': snapshot_fingerprint_dict[problem],
+                'all_feature_desc': all_feature_desc_dict,
+                'shard_shuffle': shard_shuffle,
+                'example_per_file': params.example_per_file})
+            dataset_dict[problem] = _snapshot_dataset(
+                dataset_dict[problem], snapshot_path, params, shard_shuffle=shard_shuffle,
+                num_files=len(snapshot_fingerprint_dict[problem]['tfrecord']))
     return dataset_dict
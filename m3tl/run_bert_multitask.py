@@ -1,28 +1,30 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: source_nbs/14_run_bert_multitask.ipynb (unless otherwise specified).
 
-__all__ = ['create_keras_model', 'get_params_ready', 'train_bert_multitask', 'create_tensorspec_from_shape_type',
-           'trim_checkpoint_for_prediction', 'eval_bert_multitask', 'arr_to_str', 'decode_predictions',
-           'predict_bert_multitask']
+__all__ = ['create_keras_model', 'TrainIteratorCheckpoint', 'make_checkpointable_dataset', 'get_params_ready',
+           'train_bert_multitask', 'create_tensorspec_from_shape_type', 'trim_checkpoint_for_prediction',
+           'eval_bert_multitask', 'arr_to_str', 'PredictionDecoder', 'decode_predictions', 'PredictionWriter',
+           'predict_bert_multitask', 'predict_bert_multitask_generator', 'BertMultiTaskPredictor']
 
 # Cell
 import json
 import os
 import time
 from shutil import copytree, ignore_patterns, rmtree
-from typing import Callable, Dict, List, Tuple, Union
+from typing import Callable, Dict, Generator, Iterable, List, Tuple, Union
 
 from sklearn.preprocessing import MultiLabelBinarizer
-from transformers import PreTrainedTokenizer
+from transformers import PreTrainedTokenizerBase
 
 import tensorflow as tf
 from loguru import logger
 import numpy as np
 
-from .input_fn import predict_input_fn, train_eval_input_fn
+from .input_fn import (get_batch_num, predict_input_fn,
+                           preprocess_predict_inputs, train_eval_input_fn)
 from .model_fn import BertMultiTask
 from .params import Params
 from .special_tokens import EVAL, PREDICT
-from .utils import (compress_tf_warnings, get_or_make_label_encoder,
+from .utils import (compress_tf_warnings, create_path, get_or_make_label_encoder,
                         infer_shape_and_type_from_dict, set_phase, LabelEncoder, get_is_pyspark)
 from tensorflow.python.framework.errors_impl import \
     NotFoundError as TFNotFoundError
@@ -104,13 +106,116 @@ def _has_callbacks(callbacks: List[tf.keras.callbacks.Callback], check_callback:
     return False
 
 
+class TrainIteratorCheckpoint(tf.keras.callbacks.Callback):
+    """Save train dataset iterator state whenever model checkpoint is saved
+
+    Restoring the iterator continues from the last saved batch, including
+    shuffle buffer content, instead of reading the dataset from the beginning.
+    Epoch and number of steps trained in that epoch are saved as well so that
+    training can be resumed in the middle of an epoch.
+
+    Every element buffered by the dataset is written to the checkpoint, e.g.
+    up to `params.shuffle_buffer` examples when `params.shuffle_mode` is
+    'element'. Use 'shard' shuffle mode to keep the checkpoint small.
+    """
+
+    def __init__(self, iterator, ckpt_dir: str, save_freq: Union[str, int] = 'epoch', name='train_iterator'):
+        super().__init__()
+        self.epoch = tf.Variable(0, dtype=tf.int64, trainable=False)
+        self.step = tf.Variable(0, dtype=tf.int64, trainable=False)
+        self.checkpoint = tf.train.Checkpoint(
+            iterator=iterator, epoch=self.epoch, step=self.step)
+        self.manager = tf.train.CheckpointManager(
+            self.checkpoint, directory=os.path.join(ckpt_dir, name), max_to_keep=1)
+        self.save_freq = save_freq
+        self._current_epoch = 0
+        self._batches_seen_since_last_saving = 0
+        # steps already trained in the epoch when fit starts, set when
+        # resuming in the middle of an epoch
+        self.step_offset = 0
+
+    def restore(self) -> Tuple[int, int]:
+        """Restore latest iterator state, returns epoch to resume from and
+        number of steps already trained in that epoch"""
+        if self.manager.latest_checkpoint is None:
+            logger.warning('No train iterator checkpoint found in {}, train dataset will be read from start'.format(
+                self.manager.directory))
+            return 0, 0
+        self.checkpoint.restore(self.manager.latest_checkpoint)
+        logger.info('Train iterator restored from {}'.format(
+            self.manager.latest_checkpoint))
+        return int(self.epoch.numpy()), int(self.step.numpy())
+
+    def _save(self, epoch: int, step: int = 0):
+        self.epoch.assign(epoch)
+        self.step.assign(step)
+        self.manager.save()
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._current_epoch = epoch
+
+    def on_train_batch_end(self, batch, logs=None):
+        if self.save_freq == 'epoch':
+            return
+        self._batches_seen_since_last_saving += 1
+        if self._batches_seen_since_last_saving >= self.save_freq:
+            self._batches_seen_since_last_saving = 0
+            # last batch of epoch, resume from next epoch
+            if self.params.get('steps') == batch + 1:
+                self._save(self._current_epoch + 1)
+            else:
+                self._save(self._current_epoch, self.step_offset + batch + 1)
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.step_offset = 0
+        if self.save_freq == 'epoch':
+            self._save(epoch + 1)
+
+
+def make_checkpointable_dataset(
+        dataset: tf.data.Dataset,
+        mirrored_strategy: tf.distribute.MirroredStrategy = None) -> Tuple[tf.data.Dataset, tf.data.Iterator]:
+    """Create an iterator of infinite dataset and a dataset that reads from it
+
+    The returned dataset can be passed to `model.fit` while the state of
+    returned iterator can be saved with `TrainIteratorCheckpoint`.
+
+    Prefetching is disabled after the iterator so that exactly one batch is
+    read from it per train step and no batch is skipped after resuming. If
+    `mirrored_strategy` is provided, the returned dataset is already
+    distributed without per replica buffer and should not be distributed again.
+    """
+    iterator = iter(dataset)
+    iterator_dataset = tf.data.Dataset.from_tensors(0).repeat().map(
+        lambda _: iterator.get_next())
+    options = tf.data.Options()
+    options.experimental_optimization.apply_default_optimizations = False
+    # older tf versions do not inject prefetch and configure autotune
+    # under experimental_optimization
+    if hasattr(options.experimental_optimization, 'inject_prefetch'):
+        options.experimental_optimization.inject_prefetch = False
+    if hasattr(options, 'autotune'):
+        options.autotune.enabled = False
+    elif hasattr(options.experimental_optimization, 'autotune'):
+        options.experimental_optimization.autotune = False
+    iterator_dataset = iterator_dataset.with_options(options)
+    if mirrored_strategy is not None:
+        iterator_dataset = mirrored_strategy.experimental_distribute_dataset(
+            iterator_dataset, options=tf.distribute.InputOptions(
+                experimental_fetch_to_device=False,
+                experimental_per_replica_buffer_size=0))
+    return iterator_dataset, iterator
+
+
 def _train_bert_multitask_keras_model(train_dataset: tf.data.Dataset,
                                       eval_dataset: tf.data.Dataset,
                                       model: tf.keras.Model,
                                       params: Params,
                                       mirrored_strategy: tf.distribute.MirroredStrategy = None,
                                       callbacks: List[tf.keras.callbacks.Callback] = None,
-                                      verbose=1):
+                                      verbose=1,
+                                      train_iterator: tf.data.Iterator = None,
+                                      resume=False):
 
     all_callbacks = params.gather_mtl_callbacks()
 
@@ -128,7 +233,8 @@ def _train_bert_multitask_keras_model(train_dataset: tf.data.Dataset,
         save_weights_only=True,
         monitor='val_mean_acc',
         mode='auto',
-        save_best_only=False)
+        save_best_only=False,
+        save_freq=params.checkpoint_save_freq)
 
     tensorboard_callback = tf.keras.callbacks.TensorBoard(
         log_dir=params.ckpt_dir)
@@ -152,29 +258,61 @@ def _train_bert_multitask_keras_model(train_dataset: tf.data.Dataset,
     elif not has_model_checkpoint_callback:
         all_callbacks.append(model_checkpoint_callback)
 
+    # save iterator state of train dataset with same frequency as model
+    initial_epoch, initial_step = 0, 0
+    if train_iterator is not None:
+        save_freq = params.checkpoint_save_freq
+        for callback in all_callbacks:
+            if isinstance(callback, tf.keras.callbacks.ModelCheckpoint):
+                save_freq = callback.save_freq
+        name = 'train_iterator'
+        if params.use_horovod:
+            name = '{}_{}'.format(name, hvd.rank())
+        train_iterator_checkpoint_callback = TrainIteratorCheckpoint(
+            train_iterator, params.ckpt_dir, save_freq=save_freq, name=name)
+        if resume:
+            initial_epoch, initial_step = train_iterator_checkpoint_callback.restore()
+        all_callbacks.append(train_iterator_checkpoint_callback)
+
     validation_steps = params.get('validation_steps', 1000)
 
-    if mirrored_strategy is not None:
-        with mirrored_strategy.scope():
+    def _fit(epochs: int, steps_per_epoch: int, initial_epoch: int):
+        if mirrored_strategy is not None:
+            with mirrored_strategy.scope():
+                model.fit(
+                    x=train_dataset,
+                    validation_data=eval_dataset,
+                    epochs=epochs,
+                    callbacks=all_callbacks,
+                    steps_per_epoch=steps_per_epoch,
+                    verbose=verbose,
+                    validation_steps=validation_steps,
+                    initial_epoch=initial_epoch
+                )
+        else:
             model.fit(
                 x=train_dataset,
                 validation_data=eval_dataset,
-                epochs=params.train_epoch,
+                epochs=epochs,
                 callbacks=all_callbacks,
-                steps_per_epoch=params.train_steps_per_epoch,
+                steps_per_epoch=steps_per_epoch,
                 verbose=verbose,
-                validation_steps=validation_steps
+                validation_steps=validation_steps,
+                initial_epoch=initial_epoch
             )
-    else:
-        model.fit(
-            x=train_dataset,
-            validation_data=eval_dataset,
-            epochs=params.train_epoch,
-            callbacks=all_callbacks,
-            steps_per_epoch=params.train_steps_per_epoch,
-            verbose=verbose,
-            validation_steps=validation_steps
-        )
+
+    # resumed in the middle of an epoch, train the rest of it first so that
+    # epochs stay aligned with the dataset and lr schedule
+    if initial_step > 0:
+        train_iterator_checkpoint_callback.step_offset = initial_step
+        _fit(epochs=initial_epoch + 1,
+             steps_per_epoch=params.train_steps_per_epoch - initial_step,
+             initial_epoch=initial_epoch)
+        initial_epoch += 1
+    if initial_epoch < params.train_epoch:
+        _fit(epochs=params.train_epoch,
+             steps_per_epoch=params.train_steps_per_epoch,
+             initial_epoch=initial_epoch)
     model.summary()
 
 
@@ -240,9 +378,9 @@ def train_bert_multitask(
     - processing_fn_dict (dict, optional) -- Key: problem name, value: problem data preprocessing fn. Defaults to None
     - model (tf.keras.Model, optional): if not provided, it will be created using `create_keras_model`. Defaults to None.
     - create_tf_record_only (bool, optional): if `True`, the function will only create TFRecord without training model. Defaults to False.
-    - steps_per_epoch (int, optional): steps per epochs, if not provided, train datset will be looped once to calculate steps per epoch. Defaults to None.
+    - steps_per_epoch (int, optional): steps per epochs, if not provided, calculated from length histogram of tfrecord, or train datset will be looped once if histogram is not available. Defaults to None.
     - warmup_ratio (float, optional): lr warmup ratio. Defaults to 0.1.
-    - continue_training (bool, optional): whether to resume training from `model_dir`. Defaults to False.
+    - continue_training (bool, optional): whether to resume training from `model_dir`. If `params.checkpoint_train_iterator` is set, train dataset and epoch are resumed as well. Defaults to False.
     - mirrored_strategy (MirroredStrategy, optional): Tensorflow MirroredStrategy. Defaults to None.
     - run_eagerly (bool, optional): Whether to run model eagerly. Defaults to False.
     - callbacks (list, optional): list of callbacks to add during training. If None, ModelCheckpoint will be added.
@@ -277,12 +415,13 @@ def train_bert_multitask(
     if steps_per_epoch is not None:
         train_steps = steps_per_epoch
     else:
+        train_steps = get_batch_num(params)
+    if train_steps is None:
         train_steps = 0
         for _ in train_dataset:
             train_steps += 1
     params.update_train_steps(train_steps, warmup_ratio=warmup_ratio)
 
-    train_dataset = train_eval_input_fn(params)
     train_dataset = train_dataset.repeat()
 
     one_batch = next(train_dataset.as_numpy_iterator())
@@ -292,9 +431,19 @@ def train_bert_multitask(
     elif mirrored_strategy is False:
         mirrored_strategy = None
 
+    train_iterator = None
+    if params.checkpoint_train_iterator:
+        if params.shuffle_mode == 'element':
+            logger.warning('Train iterator checkpoint stores up to {} examples of shuffle buffer, '
+                           'set shuffle_mode to shard to reduce checkpoint size'.format(params.shuffle_buffer))
+        # distributed inside to avoid prefetching batches that are not trained yet
+        train_dataset, train_iterator = make_checkpointable_dataset(
+            train_dataset, mirrored_strategy=mirrored_strategy)
+
     if num_gpus > 1 and mirrored_strategy is not False:
-        train_dataset = mirrored_strategy.experimental_distribute_dataset(
-            train_dataset)
+        if train_iterator is None:
+            train_dataset = mirrored_strategy.experimental_distribute_dataset(
+                train_dataset)
         eval_dataset = mirrored_strategy.experimental_distribute_dataset(
             eval_dataset)
 
@@ -319,7 +468,9 @@ def train_bert_multitask(
         params=params,
         mirrored_strategy=mirrored_strategy,
         callbacks=callbacks,
-        verbose=verbose
+        verbose=verbose,
+        train_iterator=train_iterator,
+        resume=mode == 'resume'
     )
     params.to_json()
     return model
@@ -435,80 +586,303 @@ def arr_to_str(inp_arr: np.ndarray) -> str:
     return l
 
 
-def decode_predictions(pred: Dict[str, np.ndarray], params: Params, array_as_str=False) -> Dict[str, Union[int, float, np.ndarray, list, str]]:
-    parsed_pred = dict()
-    problem_list = params.problem_list
-    label_encoder_dict = {p: get_or_make_label_encoder(
-        params=params, problem=p, mode=PREDICT) for p in problem_list}
-    for problem, problem_pred_array in pred.items():
+def _get_id_to_label_array(label_encoder: Union[LabelEncoder, PreTrainedTokenizerBase], size: int = 0) -> np.ndarray:
+    """Build an array whose i-th element is the label of id i"""
+    if isinstance(label_encoder, LabelEncoder):
+        return label_encoder.inverse_transform(np.arange(len(label_encoder.decode_dict)))
+    # ids beyond tokenizer vocab, e.g. padded model vocab, are decoded by tokenizer as well
+    return np.array(label_encoder.convert_ids_to_tokens(list(range(max(len(label_encoder), size)))))
+
+
+def _trim_by_input_mask(decoded: np.ndarray, input_mask: np.ndarray) -> List[np.ndarray]:
+    seq_len = input_mask.astype(bool).sum(axis=1)
+    return [row[:l] for row, l in zip(decoded, seq_len)]
+
+
+class PredictionDecoder:
+    """Decode model predictions to labels.
+
+    Label encoders and id to label arrays are loaded once per problem, then
+    predictions of a batch are decoded with numpy indexing.
+
+    If `trim_by_input_mask` is set, predictions of seq_tag problems are
+    trimmed to unpadded length and returned as a list of arrays. Other
+    problem types are not aligned with input tokens and are left as is.
+    Input mask can be output by model with `params.output_input_mask`.
 
-        # addtional outputs
-        if problem not in problem_list:
-            if isinstance(problem_pred_array, np.ndarray):
-                if array_as_str:
-                    parsed_pred[problem] = arr_to_str(problem_pred_array)
+    Args:
+        params (Params): params
+        trim_by_input_mask (bool, optional): whether to trim seq_tag predictions by input mask. Defaults to False.
+    """
+
+    support_problem_type = [
+        'multi_cls',
+        'cls',
+        'seq_tag',
+        'regression',
+        'masklm',
+        'premask_mlm',
+        'vectorfit'
+    ]
+
+    def __init__(self, params: Params, trim_by_input_mask=False):
+        self.params = params
+        self.trim_by_input_mask = trim_by_input_mask
+        self._warned_input_mask_shape = False
+        self.problem_list = params.problem_list
+        self.label_encoder_dict = {p: get_or_make_label_encoder(
+            params=params, problem=p, mode=PREDICT) for p in self.problem_list}
+        self.id_to_label_dict = {}
+
+    def _lookup(self, problem: str, ids: np.ndarray) -> np.ndarray:
+        id_to_label = self.id_to_label_dict.get(problem)
+        max_id = int(ids.max()) if ids.size else -1
+        if id_to_label is None or max_id >= len(id_to_label):
+            id_to_label = _get_id_to_label_array(
+                self.label_encoder_dict[problem], size=max_id + 1)
+            self.id_to_label_dict[problem] = id_to_label
+        if max_id >= len(id_to_label) or (ids.size and ids.min() < 0):
+            raise KeyError('Prediction of problem {} has ids out of range of {} labels'.format(
+                problem, len(id_to_label)))
+        return id_to_label[ids]
+
+    def _trim(self, decoded: np.ndarray, input_mask: np.ndarray) -> Union[np.ndarray, List[np.ndarray]]:
+        if input_mask is None:
+            return decoded
+        if input_mask.shape != decoded.shape[:2]:
+            if not self._warned_input_mask_shape:
+                logger.warning('Shape of input mask {} does not match prediction {}, skip trimming.'.format(
+                    input_mask.shape, decoded.shape))
+                self._warned_input_mask_shape = True
+            return decoded
+        return _trim_by_input_mask(decoded, input_mask)
+
+    def __call__(self, pred: Dict[str, np.ndarray], array_as_str=False, input_mask: np.ndarray = None) -> Dict[str, Union[int, float, np.ndarray, list, str]]:
+        parsed_pred = dict()
+        if input_mask is None:
+            input_mask = pred.get('model_input_mask')
+        for problem, problem_pred_array in pred.items():
+
+            # addtional outputs
+            if problem not in self.problem_list:
+                if isinstance(problem_pred_array, np.ndarray):
+                    if array_as_str:
+                        parsed_pred[problem] = arr_to_str(problem_pred_array)
+                    else:
+                        parsed_pred[problem] = problem_pred_array
                 else:
                     parsed_pred[problem] = problem_pred_array
-            else:
-                parsed_pred[problem] = problem_pred_array
-            continue
+                continue
 
-        label_encoder = label_encoder_dict[problem]
-
-        support_problem_type = [
-            'multi_cls',
-            'cls',
-            'seq_tag',
-            'regression',
-            'masklm',
-            'premask_mlm',
-            'vectorfit'
-        ]
-
-        problem_type = params.get_problem_type(problem=problem)
-        if problem_type not in support_problem_type:
-            logger.warning("trying to decode prediction of unsupported problem type"
-            " {}, if any error raised, please disable decode prediction.".format(problem_type))
-
-        is_multi_cls = params.get_problem_type(problem=problem) == 'multi_cls'
-        is_cls = params.get_problem_type(problem=problem) == 'cls'
-        is_seq_tag = params.get_problem_type(problem=problem) == 'seq_tag'
-        is_regression = params.get_problem_type(
-            problem=problem) == 'regression'
-
-        if is_regression:
-            parsed_pred[problem] = problem_pred_array
-            continue
+            label_encoder = self.label_encoder_dict[problem]
 
-        # get pred from prob
-        if is_multi_cls:
-            problem_pred = problem_pred_array >= 0.5
-        elif is_cls or is_seq_tag:
-            problem_pred = np.argmax(problem_pred_array, axis=-1)
-            # problem_pred = problem_pred_array
-        else:
-            problem_pred = problem_pred_array
+            problem_type = self.params.get_problem_type(problem=problem)
+            if problem_type not in self.support_problem_type:
+                logger.warning("trying to decode prediction of unsupported problem type"
+                " {}, if any error raised, please disable decode prediction.".format(problem_type))
 
-        # sequence labels
-        if is_seq_tag:
-            parsed_problem_pred = np.apply_along_axis(
-                label_encoder.inverse_transform, axis=1, arr=problem_pred)
-        else:
-            if isinstance(label_encoder, MultiLabelBinarizer) or isinstance(label_encoder, LabelEncoder):
+            if problem_type == 'regression':
+                parsed_pred[problem] = problem_pred_array
+                continue
+
+            # get pred from prob
+            if problem_type == 'multi_cls':
+                problem_pred = problem_pred_array >= 0.5
+            elif problem_type in ['cls', 'seq_tag']:
+                problem_pred = np.argmax(problem_pred_array, axis=-1)
+            elif isinstance(label_encoder, PreTrainedTokenizerBase) and \
+                    np.issubdtype(problem_pred_array.dtype, np.floating):
+                # masklm outputs probabilities of vocab
+                problem_pred = np.argmax(problem_pred_array, axis=-1)
+            else:
+                problem_pred = problem_pred_array
+
+            if isinstance(label_encoder, MultiLabelBinarizer):
                 parsed_problem_pred = label_encoder.inverse_transform(
                     problem_pred)
-            elif isinstance(label_encoder, PreTrainedTokenizer):
-                parsed_problem_pred = np.apply_along_axis(
-                    label_encoder.convert_ids_to_tokens, axis=1, arr=problem_pred
-                )
+            elif isinstance(label_encoder, (LabelEncoder, PreTrainedTokenizerBase)):
+                parsed_problem_pred = self._lookup(problem, problem_pred)
+                # sequence labels
+                if self.trim_by_input_mask and problem_type == 'seq_tag' and parsed_problem_pred.ndim == 2:
+                    parsed_problem_pred = self._trim(
+                        parsed_problem_pred, input_mask)
             else:
                 parsed_problem_pred = problem_pred_array
 
-        parsed_pred[problem] = parsed_problem_pred
-    return parsed_pred
+            parsed_pred[problem] = parsed_problem_pred
+        return parsed_pred
+
+
+def decode_predictions(pred: Dict[str, np.ndarray], params: Params, array_as_str=False, input_mask: np.ndarray = None, trim_by_input_mask=False) -> Dict[str, Union[int, float, np.ndarray, list, str]]:
+    """Decode model predictions to labels, see `PredictionDecoder`.
+
+    Args:
+        pred (Dict[str, np.ndarray]): predictions returned by model
+        params (Params): params
+        array_as_str (bool, optional): whether to convert additional array outputs to json strings. Defaults to False.
+        input_mask (np.ndarray, optional): [batch_size, seq_len] input mask to trim seq_tag predictions.
+            Defaults to None, which uses `model_input_mask` in pred if any.
+        trim_by_input_mask (bool, optional): whether to trim seq_tag predictions by input mask. Defaults to False.
+    """
+    return PredictionDecoder(params, trim_by_input_mask=trim_by_input_mask)(
+        pred, array_as_str=array_as_str, input_mask=input_mask)
 
 
 # Cell
+def _flatten_pred_dict(pred: dict, prefix='') -> dict:
+    flat_pred = {}
+    for name, value in pred.items():
+        name = '{}_{}'.format(prefix, name) if prefix else name
+        if isinstance(value, dict):
+            flat_pred.update(_flatten_pred_dict(value, prefix=name))
+        else:
+            flat_pred[name] = value
+    return flat_pred
+
+
+def _to_python_type(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (list, tuple)):
+        return [_to_python_type(v) for v in value]
+    return value
+
+
+class PredictionWriter:
+    """Write predictions batch by batch.
+
+    Supported formats:
+    - jsonl: one json line per example.
+    - parquet: one row group per batch, requires pyarrow.
+    - npz: `output_path` is a directory with one `part-xxxxx.npz` file per batch.
+        Ragged predictions, e.g. sequence labels trimmed by input mask, are
+        concatenated and saved along with `<name>_length`.
+
+    Nested outputs are flattened and named `<parent>_<child>`.
+
+    Args:
+        output_path (str): output file path, or output dir for npz
+        output_format (str, optional): 'jsonl', 'parquet' or 'npz'. Defaults to None, which
+            infers from extension of `output_path`.
+    """
+
+    support_format = ['jsonl', 'parquet', 'npz']
+
+    def __init__(self, output_path: str, output_format: str = None):
+        if output_format is None:
+            output_format = os.path.splitext(output_path)[1].lstrip('.')
+            output_format = {'json': 'jsonl', '': 'npz'}.get(
+                output_format, output_format)
+        if output_format not in self.support_format:
+            raise ValueError('output_format should be one of {}, got: {}'.format(
+                self.support_format, output_format))
+        self.output_path = output_path
+        self.output_format = output_format
+        self.num_batches = 0
+        self._writer = None
+
+        if output_format == 'npz':
+            create_path(output_path)
+        elif os.path.dirname(output_path):
+            create_path(os.path.dirname(output_path))
+
+        if output_format == 'jsonl':
+            self._writer = open(output_path, 'w', encoding='utf8')
+        elif output_format == 'parquet':
+            try:
+                import pyarrow
+                import pyarrow.parquet
+            except ImportError:
+                raise ImportError(
+                    'pyarrow is not installed, cannot write predictions as parquet.')
+            self._pa = pyarrow
+            self._pq = pyarrow.parquet
+
+    def write(self, pred: Dict[str, Union[np.ndarray, list]]):
+        pred = _flatten_pred_dict(pred)
+        if self.output_format == 'npz':
+            self._write_npz(pred)
+        else:
+            names = list(pred.keys())
+            columns = [_to_python_type(pred[name]) for name in names]
+            if self.output_format == 'jsonl':
+                for row in zip(*columns):
+                    self._writer.write(json.dumps(
+                        dict(zip(names, row)), ensure_ascii=False) + '\n')
+            else:
+                table = self._pa.table(
+                    {name: self._pa.array(col) for name, col in zip(names, columns)})
+                if self._writer is None:
+                    self._writer = self._pq.ParquetWriter(
+                        self.output_path, table.schema)
+                else:
+                    table = table.cast(self._writer.schema)
+                self._writer.write_table(table)
+        self.num_batches += 1
+
+    def _write_npz(self, pred: Dict[str, Union[np.ndarray, list]]):
+        arrays = {}
+        for name, value in pred.items():
+            if isinstance(value, np.ndarray):
+                arrays[name] = value
+                continue
+            rows = [np.asarray(row) for row in value]
+            non_empty_rows = [row for row in rows if row.size]
+            arrays[name] = np.concatenate(
+                non_empty_rows) if non_empty_rows else np.array([])
+            arrays['{}_length'.format(name)] = np.array(
+                [len(row) for row in rows])
+        np.savez(os.path.join(self.output_path,
+                              'part-{:05d}.npz'.format(self.num_batches)), **arrays)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# Cell
+def _get_predict_model_and_dataset(
+        inputs,
+        problem: str,
+        model_dir: str,
+        params: Params,
+        problem_type_dict: Dict[str, str],
+        processing_fn_dict: Dict[str, Callable],
+        model: tf.keras.Model,
+        run_eagerly: bool,
+        mirrored_strategy) -> Tuple[tf.keras.Model, tf.data.Dataset]:
+    set_phase(PREDICT)
+    if params is None:
+        params = Params()
+    if not model_dir and params is not None:
+        model_dir = params.ckpt_dir
+    params = get_params_ready(problem, 1, model_dir,
+                              params, problem_type_dict, processing_fn_dict,
+                              mode='predict', json_path=os.path.join(model_dir, 'params.json'))
+
+    logger.info('Checkpoint dir: {}'.format(params.ckpt_dir))
+    time.sleep(3)
+
+    pred_dataset, one_batch_data = predict_input_fn(
+        inputs, params, return_first_batch=True)
+
+    if model is None:
+        model = create_keras_model(
+            mirrored_strategy=mirrored_strategy, params=params,
+            mode='predict', inputs_to_build_model=one_batch_data,
+            run_eagerly=run_eagerly)
+    return model, pred_dataset
+
+
 @logger.catch
 def predict_bert_multitask(
         inputs,
@@ -537,27 +911,10 @@ def predict_bert_multitask(
         - mirrored_strategy (optional): mirrored strategy for distribute prediction. Defaults to None.
         - decode_prediction (bool, optional): whether to decode predictions. Defaults to False.
     """
-    set_phase(PREDICT)
-    if params is None:
-        params = Params()
-    if not model_dir and params is not None:
-        model_dir = params.ckpt_dir
-    params = get_params_ready(problem, 1, model_dir,
-                              params, problem_type_dict, processing_fn_dict,
-                              mode='predict', json_path=os.path.join(model_dir, 'params.json'))
-
-    logger.info('Checkpoint dir: {}'.format(params.ckpt_dir))
-    time.sleep(3)
-
-    pred_dataset = predict_input_fn(inputs, params)
-    one_batch_data = next(pred_dataset.as_numpy_iterator())
-    pred_dataset = predict_input_fn(inputs, params)
-
-    if model is None:
-        model = create_keras_model(
-            mirrored_strategy=mirrored_strategy, params=params,
-            mode='predict', inputs_to_build_model=one_batch_data,
-            run_eagerly=run_eagerly)
+    model, pred_dataset = _get_predict_model_and_dataset(
+        inputs=inputs, problem=problem, model_dir=model_dir, params=params,
+        problem_type_dict=problem_type_dict, processing_fn_dict=processing_fn_dict,
+        model=model, run_eagerly=run_eagerly, mirrored_strategy=mirrored_strategy)
 
     if mirrored_strategy is not None:
         with mirrored_strategy.scope():
@@ -571,3 +928,190 @@ def predict_bert_multitask(
     if return_model:
         return pred, model
     return pred
+
+
+def predict_bert_multitask_generator(
+        inputs,
+        problem='weibo_ner',
+        model_dir='',
+        params: Params = None,
+        problem_type_dict: Dict[str, str] = None,
+        processing_fn_dict: Dict[str, Callable] = None,
+        model: tf.keras.Model = None,
+        run_eagerly=False,
+        mirrored_strategy=None,
+        decode_prediction=False,
+        output_path: str = None,
+        output_format: str = None) -> Generator[Dict[str, Union[np.ndarray, list]], None, None]:
+    """Use Multi-task Bert model to do prediction batch by batch
+
+    Unlike `predict_bert_multitask`, predictions are not accumulated in memory.
+    Predictions of every batch are yielded and optionally written to `output_path`.
+    To only write predictions, just exhaust the generator.
+
+        Args:
+        - inputs (Iterable): Iterable of inputs
+        - problem (str, optional): problems to predict. Defaults to 'weibo_ner'.
+        - model_dir (str, optional): model dir. Defaults to ''.
+        - params (Params, optional): params. Defaults to None.
+        - problem_type_dict (Dict[str, str], optional): Key: problem name, value: problem type.. Defaults to None.
+        - processing_fn_dict (Dict[str, Callable], optional): Key: problem name, value: problem data preprocessing fn. Defaults to None.
+        - model (tf.keras.Model, optional): If not provided, it will be created with `create_keras_model`. Defaults to None.
+        - run_eagerly (bool, optional): Whether to run model eagerly. Defaults to False.
+        - mirrored_strategy (optional): mirrored strategy for distribute prediction. Defaults to None.
+        - decode_prediction (bool, optional): whether to decode predictions. Defaults to False.
+        - output_path (str, optional): path to write predictions, see `PredictionWriter`. Defaults to None.
+        - output_format (str, optional): 'jsonl', 'parquet' or 'npz'. Defaults to None, which infers from `output_path`.
+    """
+    model, pred_dataset = _get_predict_model_and_dataset(
+        inputs=inputs, problem=problem, model_dir=model_dir, params=params,
+        problem_type_dict=problem_type_dict, processing_fn_dict=processing_fn_dict,
+        model=model, run_eagerly=run_eagerly, mirrored_strategy=mirrored_strategy)
+
+    decoder = PredictionDecoder(model.params) if decode_prediction else None
+    writer = PredictionWriter(
+        output_path, output_format=output_format) if output_path else None
+    try:
+        for batch in pred_dataset:
+            if mirrored_strategy is not None:
+                with mirrored_strategy.scope():
+                    pred = model.predict_on_batch(batch)
+            else:
+                pred = model.predict_on_batch(batch)
+            if decoder is not None:
+                pred = decoder(pred)
+            if writer is not None:
+                writer.write(pred)
+            yield pred
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+# Cell
+def _pad_feature_dict_list(feature_dict_list: List[dict]) -> Dict[str, np.ndarray]:
+    """Stack feature dicts to a batch, padding first dim of features with zeros like `padded_batch`"""
+    batch = {}
+    for feature_name, first_feature in feature_dict_list[0].items():
+        feature_list = [f[feature_name] for f in feature_dict_list]
+        if not isinstance(first_feature, (list, np.ndarray)) and not np.issubdtype(type(first_feature), np.number):
+            batch[feature_name] = np.array(
+                [f.encode('utf8') if isinstance(f, str) else f for f in feature_list], dtype=object)
+            continue
+        feature_list = [np.asarray(f) for f in feature_list]
+        dtype = np.int32 if np.issubdtype(
+            feature_list[0].dtype, np.integer) else np.float32
+        if feature_list[0].ndim == 0:
+            batch[feature_name] = np.array(feature_list, dtype=dtype)
+            continue
+        max_len = max([f.shape[0] for f in feature_list])
+        padded_feature = np.zeros(
+            [len(feature_list), max_len] + list(feature_list[0].shape[1:]), dtype=dtype)
+        for ind, feature in enumerate(feature_list):
+            padded_feature[ind, :feature.shape[0]] = feature
+        batch[feature_name] = padded_feature
+    return batch
+
+
+class BertMultiTaskPredictor:
+    """Long-lived predictor for low latency inference, e.g. to be wrapped by a web service.
+
+    Params, tokenizer, label encoders and model weights are loaded once when
+    the predictor is created. Model call is traced once with dynamic batch size
+    and sequence length and warmed up with `warmup_inputs`, so every `predict`
+    call only preprocesses inputs and runs the traced graph.
+
+    Inputs of every `predict` call should have the same modalities as `warmup_inputs`.
+
+    Example:
+        predictor = BertMultiTaskPredictor(problem='weibo_ner', model_dir='models/weibo_ner_ckpt')
+        pred = predictor.predict(['this is a test'])
+
+        Args:
+        - problem (str, optional): problems to predict. Defaults to 'weibo_ner'.
+        - model_dir (str, optional): model dir. Defaults to ''.
+        - params (Params, optional): params. Defaults to None.
+        - problem_type_dict (Dict[str, str], optional): Key: problem name, value: problem type.. Defaults to None.
+        - processing_fn_dict (Dict[str, Callable], optional): Key: problem name, value: problem data preprocessing fn. Defaults to None.
+        - model (tf.keras.Model, optional): If not provided, it will be created with `create_keras_model`. Defaults to None.
+        - decode_prediction (bool, optional): whether to decode predictions. Defaults to True.
+        - trim_by_input_mask (bool, optional): whether to trim decoded seq_tag predictions to unpadded length. Sets `params.output_input_mask` of the model. Defaults to False.
+        - warmup_inputs (Iterable, optional): inputs to build and warm up model. Defaults to None, which uses a toy text.
+    """
+
+    def __init__(self,
+                 problem='weibo_ner',
+                 model_dir='',
+                 params: Params = None,
+                 problem_type_dict: Dict[str, str] = None,
+                 processing_fn_dict: Dict[str, Callable] = None,
+                 model: tf.keras.Model = None,
+                 decode_prediction=True,
+                 trim_by_input_mask=False,
+                 warmup_inputs: Iterable = None):
+        set_phase(PREDICT)
+        if params is None:
+            params = Params()
+        if not model_dir:
+            model_dir = params.ckpt_dir
+        params = get_params_ready(problem, 1, model_dir,
+                                  params, problem_type_dict, processing_fn_dict,
+                                  mode='predict', json_path=os.path.join(model_dir, 'params.json'))
+        logger.info('Checkpoint dir: {}'.format(params.ckpt_dir))
+
+        warmup_batch = self._make_batch(
+            warmup_inputs or ['this is a warm up input'], params)
+        if model is None:
+            model = create_keras_model(
+                mirrored_strategy=None, params=params,
+                mode='predict', inputs_to_build_model=warmup_batch)
+        self.model = model
+        self.params = model.params
+        # flag is read when model call is traced below, so it also applies
+        # to a caller-supplied model
+        output_input_mask = decode_prediction and trim_by_input_mask
+        if output_input_mask:
+            self.params.output_input_mask = True
+        self.decoder = PredictionDecoder(
+            self.params, trim_by_input_mask=trim_by_input_mask) if decode_prediction else None
+
+        input_signature = {
+            feature_name: tf.TensorSpec(
+                [None] * min(feature.ndim, 2) + list(feature.shape[2:]),
+                dtype=tf.string if feature.dtype == object else tf.as_dtype(feature.dtype))
+            for feature_name, feature in warmup_batch.items()}
+        self._predict_fn = tf.function(
+            self._call_model, input_signature=[input_signature])
+        warmup_pred = self._predict_fn(warmup_batch)
+        if output_input_mask and 'model_input_mask' not in warmup_pred:
+            raise ValueError(
+                'trim_by_input_mask is set but model does not output model_input_mask')
+
+    def _call_model(self, features: Dict[str, tf.Tensor]) -> Dict[str, tf.Tensor]:
+        return self.model(features)
+
+    @staticmethod
+    def _make_batch(inputs: Iterable, params: Params) -> Dict[str, np.ndarray]:
+        # pass an iterator, a list of exactly two inputs would otherwise be
+        # unpacked as (inputs, labels) by preprocessing fn
+        feature_dict_list = list(
+            preprocess_predict_inputs(iter(list(inputs)), params))
+        if not feature_dict_list:
+            raise ValueError('no input to predict')
+        return _pad_feature_dict_list(feature_dict_list)
+
+    def predict(self, inputs: Iterable) -> Dict[str, Union[np.ndarray, list]]:
+        """Predict inputs as one batch
+
+        Args:
+            inputs (Iterable): inputs, e.g. list of text or list of dict of modalities
+
+        Returns:
+            Dict[str, Union[np.ndarray, list]]: (decoded) predictions
+        """
+        set_phase(PREDICT)
+        pred = self._predict_fn(self._make_batch(inputs, self.params))
+        pred = tf.nest.map_structure(lambda t: t.numpy(), pred)
+        if self.decoder is not None:
+            pred = self.decoder(pred)
+        return pred
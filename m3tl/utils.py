@@ -1,18 +1,22 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: source_nbs/01_utils.ipynb (unless otherwise specified).
 
-__all__ = ['load_transformer_tokenizer', 'load_transformer_config', 'load_transformer_model',
-           'get_label_encoder_save_path', 'LabelEncoder', 'create_path', 'need_make_label_encoder',
-           'get_or_make_label_encoder', 'cluster_alphnum', 'filter_empty', 'infer_shape_and_type_from_dict',
-           'get_transformer_main_model', 'get_embedding_table_from_model', 'get_shape_list', 'gather_indexes',
-           'dispatch_features', 'create_dict_from_nested_model', 'variable_summaries', 'set_phase', 'get_phase',
-           'set_is_pyspark', 'get_is_pyspark', 'M3TL_PHASE', 'IS_PYSPARK', 'TFRedundantWarningFilter',
-           'compress_tf_warnings']
+__all__ = ['verify_fast_tokenizer', 'get_tokenizer_fingerprint', 'load_transformer_tokenizer',
+           'load_transformer_config', 'load_transformer_model', 'get_label_encoder_save_path', 'LabelEncoder',
+           'create_path', 'need_make_label_encoder', 'get_or_make_label_encoder', 'cluster_alphnum', 'filter_empty',
+           'infer_shape_and_type_from_dict', 'get_transformer_main_model', 'get_embedding_table_from_model',
+           'get_shape_list', 'gather_indexes', 'dispatch_features', 'create_dict_from_nested_model',
+           'variable_summaries', 'set_phase', 'get_phase', 'set_is_pyspark', 'get_is_pyspark', 'M3TL_PHASE',
+           'IS_PYSPARK', 'TFRedundantWarningFilter', 'compress_tf_warnings']
 
 # Cell
+import hashlib
+import json
 import os
 import pickle
 import re
-from typing import Union
+import weakref
+from functools import lru_cache
+from typing import List, Union
 from inspect import getmembers
 from collections import defaultdict
 
@@ -29,21 +33,148 @@ from transformers import AutoTokenizer, PreTrainedTokenizer, TFPreTrainedModel
 from .special_tokens import TRAIN, EVAL, PREDICT
 
 # Cell
-def load_transformer_tokenizer(tokenizer_name: str, load_module_name=None):
+# texts to check whether fast tokenizer gives the same ids as slow tokenizer
+_TOKENIZER_VERIFY_TEXTS = [
+    '这是一个测试，包含全角标点！',
+    'This is a Test, with UPPER case and 12345 numbers.',
+    '中英文混合 mixed text 和数字 2021年',
+    'accénts naïve café Ångström',
+    '  extra   spaces\tand\nnewlines  ',
+    'emoji 😀 and rare 𠀀 characters',
+    '[MASK] special [SEP] tokens [UNK]',
+    'unbelievably longwordswithoutspaces'
+]
+
+
+def verify_fast_tokenizer(slow_tokenizer: PreTrainedTokenizer, fast_tokenizer: PreTrainedTokenizer, texts: List[str] = None) -> bool:
+    """Check whether fast tokenizer gives the same ids as slow tokenizer on sample texts
+
+    Args:
+        slow_tokenizer (PreTrainedTokenizer): slow tokenizer
+        fast_tokenizer (PreTrainedTokenizer): fast tokenizer
+        texts (List[str], optional): sample texts. Defaults to None.
+    """
+    texts = texts or _TOKENIZER_VERIFY_TEXTS
+    try:
+        if slow_tokenizer.get_vocab() != fast_tokenizer.get_vocab():
+            return False
+        for text, text_pair in zip(texts, texts[1:] + texts[:1]):
+            for args in [(text,), (text, text_pair)]:
+                slow_dict = slow_tokenizer(*args)
+                fast_dict = fast_tokenizer(*args)
+                if slow_dict['input_ids'] != fast_dict['input_ids']:
+                    return False
+                if slow_dict.get('token_type_ids') != fast_dict.get('token_type_ids'):
+                    return False
+            # pre-tokenized inputs
+            words = [c for c in text if not c.isspace()]
+            if slow_tokenizer(words, is_split_into_words=True)['input_ids'] != \
+                    fast_tokenizer(words, is_split_into_words=True)['input_ids']:
+                return False
+    except Exception as e:
+        logger.warning('Error when verifying fast tokenizer: {}'.format(e))
+        return False
+    return True
+
+
+_TOKENIZER_FINGERPRINT_DICT = weakref.WeakKeyDictionary()
+
+
+def get_tokenizer_fingerprint(tokenizer: PreTrainedTokenizer) -> str:
+    """Hash of tokenizer content that changes tokenization results
+
+    Fingerprint is made of tokenizer class, vocab, special tokens and init
+    settings like `do_lower_case`. Paths are not included, so copies of the
+    same tokenizer, e.g. saved to different checkpoint dirs, have the same
+    fingerprint. Fast and slow versions of a tokenizer are treated the same
+    since fast tokenizer is only used when it gives the same ids.
+
+    Args:
+        tokenizer (PreTrainedTokenizer): tokenizer
+    """
+    if tokenizer not in _TOKENIZER_FINGERPRINT_DICT:
+        class_name = type(tokenizer).__name__
+        if class_name.endswith('Fast'):
+            class_name = class_name[:-len('Fast')]
+        settings = {k: v for k, v in tokenizer.init_kwargs.items()
+                    if k not in ['name_or_path', 'model_max_length'] and not k.startswith('_') and not k.endswith('_file')}
+        fingerprint = [class_name, sorted(tokenizer.get_vocab().items()),
+                       tokenizer.special_tokens_map, settings]
+        _TOKENIZER_FINGERPRINT_DICT[tokenizer] = hashlib.sha1(json.dumps(
+            fingerprint, sort_keys=True, ensure_ascii=False, default=str).encode('utf8')).hexdigest()
+    return _TOKENIZER_FINGERPRINT_DICT[tokenizer]
+
+
+def _get_local_files_mtime(path: str) -> Union[float, None]:
+    if os.path.isdir(path):
+        return max([os.path.getmtime(os.path.join(path, f)) for f in os.listdir(path)], default=None)
+    if os.path.isfile(path):
+        return os.path.getmtime(path)
+    return None
+
+
+def load_transformer_tokenizer(tokenizer_name: str, load_module_name=None, use_fast=True):
     """some tokenizers cannot be loaded using AutoTokenizer.
 
     this function served as a util function to catch that situation.
 
+    If `use_fast` and the tokenizer has a fast version, e.g. BertTokenizerFast
+    for BertTokenizer or the one loaded by AutoTokenizer, the fast tokenizer is
+    returned if it gives the same ids as the slow one on sample texts. Otherwise
+    the slow tokenizer is returned.
+
+    Loaded tokenizers are cached in process and shared by callers. The cache is
+    keyed by arguments and mtime of local tokenizer files.
+
     Args:
         tokenizer_name (str): tokenizer name
+        load_module_name (str, optional): tokenizer class name in transformers. Defaults to None.
+        use_fast (bool, optional): whether to use fast tokenizer if possible. Defaults to True.
     """
-    if load_module_name:
-        tok = getattr(transformers, load_module_name).from_pretrained(
-            tokenizer_name)
-    else:
-        tok = AutoTokenizer.from_pretrained(tokenizer_name)
+    return _load_transformer_tokenizer_cached(
+        tokenizer_name, load_module_name, use_fast, _get_local_files_mtime(tokenizer_name))
+
+
+def _get_verified_tokenizer(slow_tok: PreTrainedTokenizer, fast_tok: PreTrainedTokenizer) -> PreTrainedTokenizer:
+    if not verify_fast_tokenizer(slow_tok, fast_tok):
+        logger.warning('{} gives different ids from {}, use {} instead'.format(
+            type(fast_tok).__name__, type(slow_tok).__name__, type(slow_tok).__name__))
+        return slow_tok
+    return fast_tok
 
-    return tok
+
+@lru_cache(maxsize=16)
+def _load_transformer_tokenizer_cached(tokenizer_name: str, load_module_name: str, use_fast: bool, files_mtime: float):
+    if not load_module_name:
+        tok = AutoTokenizer.from_pretrained(tokenizer_name, use_fast=use_fast)
+        if not tok.is_fast:
+            return tok
+        try:
+            slow_tok = AutoTokenizer.from_pretrained(
+                tokenizer_name, use_fast=False)
+        except Exception as e:
+            logger.warning('Failed to load slow tokenizer of {}, fast tokenizer is not verified: {}'.format(
+                tokenizer_name, e))
+            return tok
+        # no slow version to compare with
+        if slow_tok.is_fast:
+            return tok
+        return _get_verified_tokenizer(slow_tok, tok)
+
+    tok = getattr(transformers, load_module_name).from_pretrained(
+        tokenizer_name)
+    fast_module_name = '{}Fast'.format(load_module_name)
+    if not use_fast or tok.is_fast or not hasattr(transformers, fast_module_name):
+        return tok
+
+    try:
+        fast_tok = getattr(transformers, fast_module_name).from_pretrained(
+            tokenizer_name)
+    except Exception as e:
+        logger.warning('Failed to load {}, use {} instead: {}'.format(
+            fast_module_name, load_module_name, e))
+        return tok
+    return _get_verified_tokenizer(tok, fast_tok)
 
 # Cell
 def load_transformer_config(config_name_or_dict, load_module_name=None):
@@ -100,6 +231,36 @@ def get_label_encoder_save_path(params, problem: str) -> str:
 
 # Cell
 class LabelEncoder(BaseEstimator, TransformerMixin):
+    """Encode labels with value between 0 and n_classes-1.
+
+    `encode_dict` and `decode_dict` are kept for compatibility. If labels
+    can be held in a non-object numpy array, `inverse_transform` and
+    `transform` of numpy arrays or numeric labels work on whole batches with
+    a sorted array of classes. Converting a list of strings to numpy costs
+    more than dict lookup, so such lists are still encoded with `encode_dict`.
+    """
+
+    def _build_classes(self):
+        self._classes = None
+        classes = [self.decode_dict.get(i) for i in range(
+            len(self.decode_dict))]
+        if set(self.decode_dict.keys()) != set(range(len(self.decode_dict))):
+            return
+        try:
+            classes = np.array(classes)
+        except Exception:
+            return
+        if classes.ndim != 1 or classes.dtype.kind not in 'biufU':
+            return
+        # searchsorted needs sorted classes with no duplicates
+        if classes.size > 1 and not np.all(classes[1:] > classes[:-1]):
+            return
+        self._classes = classes
+
+    def _get_classes(self):
+        if not hasattr(self, '_classes'):
+            self._build_classes()
+        return self._classes
 
     def fit(self, y):
         """Fit label encoder
@@ -124,6 +285,7 @@ class LabelEncoder(BaseEstimator, TransformerMixin):
             self.encode_dict[l] = new_ind
             self.decode_dict[new_ind] = l
 
+        self._build_classes()
         return self
 
     def fit_transform(self, y):
@@ -150,11 +312,21 @@ class LabelEncoder(BaseEstimator, TransformerMixin):
         -------
         y : array-like of shape [n_samples]
         """
-        encode_y = []
-        for l in y:
-            encode_y.append(self.encode_dict[l])
-
-        return np.array(encode_y)
+        classes = self._get_classes()
+        if classes is not None and (isinstance(y, np.ndarray) or classes.dtype.kind != 'U'):
+            y_array = np.asarray(y)
+            if y_array.ndim == 1 and (y_array.dtype.kind == classes.dtype.kind or (
+                    y_array.dtype.kind in 'iuf' and classes.dtype.kind in 'iuf')):
+                if not y_array.size:
+                    return np.array([], dtype=int)
+                encode_y = np.searchsorted(classes, y_array)
+                encode_y = np.minimum(encode_y, classes.size - 1)
+                unseen = classes[encode_y] != y_array
+                if np.any(unseen):
+                    raise KeyError(y_array[unseen][0])
+                return encode_y
+
+        return np.fromiter(map(self.encode_dict.__getitem__, y), dtype=int)
 
     def inverse_transform(self, y):
         """Transform labels back to original encoding.
@@ -166,6 +338,15 @@ class LabelEncoder(BaseEstimator, TransformerMixin):
         -------
         y : numpy array of shape [n_samples]
         """
+        classes = self._get_classes()
+        if classes is not None:
+            y_array = np.asarray(y)
+            if y_array.dtype.kind in 'iu':
+                if y_array.size and (y_array.min() < 0 or y_array.max() >= classes.size):
+                    out_of_range = (y_array < 0) | (y_array >= classes.size)
+                    raise KeyError(y_array[out_of_range][0])
+                return classes[y_array]
+
         decode_y = []
         for l in y:
             decode_y.append(self.decode_dict[l])
@@ -181,6 +362,7 @@ class LabelEncoder(BaseEstimator, TransformerMixin):
             self.decode_dict = pickle.load(f)
 
         self.encode_dict = {v: k for k, v in self.decode_dict.items()}
+        self._build_classes()
 
 
 def create_path(path):